@@ -0,0 +1,57 @@
+"""Check which replica set member serves primary and reporting reads.
+
+Runs with the same MONGO_* settings the backend reads from .env / the environment.
+See bench/replica-set.compose.yml for a local three-member replica set.
+
+    MONGO_URL="mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0" \
+        DB_NAME=kuvot_bench python -m bench.check_read_routing
+"""
+import asyncio
+from collections import Counter
+
+from pymongo import monitoring
+
+class AddressRecorder(monitoring.CommandListener):
+    def __init__(self):
+        self.label = None
+        self.seen = Counter()
+
+    def started(self, event):
+        if self.label and event.command_name in ("find", "aggregate"):
+            self.seen[(self.label, event.connection_id)] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+recorder = AddressRecorder()
+# Must be registered before server.py creates its client
+monitoring.register(recorder)
+
+import server  # noqa: E402
+
+async def main(rounds: int = 20):
+    # Let the driver discover the replica set topology
+    await server.client.admin.command("ping")
+    await asyncio.sleep(1)
+    primary = server.client.primary
+    secondaries = server.client.secondaries
+    print(f"primary: {primary}  secondaries: {sorted(secondaries)}")
+    print(f"reporting read preference: {server.reporting_db.read_preference.document}")
+    print(f"compressors: {server.client_options.get('compressors', 'none')}  "
+          f"pool: {server.client_options['maxPoolSize']}")
+
+    for label, database in (("primary db", server.db), ("reporting db", server.reporting_db)):
+        recorder.label = label
+        for _ in range(rounds):
+            await database.orders.find_one({})
+        recorder.label = None
+
+    for (label, address), count in sorted(recorder.seen.items()):
+        role = "primary" if address == primary else "secondary" if address in secondaries else "?"
+        print(f"  {label:<13} -> {address[0]}:{address[1]} ({role}) x{count}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
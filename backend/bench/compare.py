@@ -0,0 +1,51 @@
+"""Compare two benchmark result files written by bench.run.
+
+    python -m bench.compare bench/results/abc123.json bench/results/def456.json --fail-threshold 10
+"""
+import argparse
+import json
+import sys
+
+METRICS = [("throughput_rps", True), ("p50_ms", False), ("p99_ms", False)]
+
+def load_runs(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    return report["meta"], {run["orders"]: run["scenarios"] for run in report["runs"]}
+
+def change_pct(old: float, new: float) -> float:
+    return (new - old) / old * 100 if old else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--fail-threshold", type=float, default=0,
+                        help="exit with status 1 if any metric regresses by more than this percent")
+    args = parser.parse_args()
+
+    base_meta, base = load_runs(args.baseline)
+    cand_meta, cand = load_runs(args.candidate)
+    print(f"baseline {base_meta['revision']}  vs  candidate {cand_meta['revision']}")
+
+    regressions = []
+    for size in sorted(set(base) & set(cand)):
+        print(f"\n== {size} orders ==")
+        print(f"  {'scenario':<24}" + "".join(f"{name:>26}" for name, _ in METRICS))
+        for scenario in sorted(set(base[size]) & set(cand[size])):
+            cells = []
+            for name, higher_is_better in METRICS:
+                old, new = base[size][scenario][name], cand[size][scenario][name]
+                delta = change_pct(old, new)
+                regression = -delta if higher_is_better else delta
+                if args.fail_threshold and regression > args.fail_threshold:
+                    regressions.append(f"{size}/{scenario}/{name} {delta:+.1f}%")
+                cells.append(f"{old:>9.1f} → {new:>9.1f} {delta:+6.1f}%")
+            print(f"  {scenario:<24}" + "".join(f"{c:>26}" for c in cells))
+
+    if regressions:
+        print("\nRegressions over threshold:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
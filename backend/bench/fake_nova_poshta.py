@@ -0,0 +1,88 @@
+"""Local stand-in for the Nova Poshta JSON API.
+
+Point the backend at it with NOVA_POSHTA_API_URL=http://127.0.0.1:8765/v2.0/json/
+
+    python -m bench.fake_nova_poshta --port 8765 --latency-ms 80
+    python -m bench.fake_nova_poshta --outage-rate 0.3   # exercise job retries
+"""
+import argparse
+import asyncio
+import itertools
+import uuid
+from datetime import datetime, timedelta
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+
+app = FastAPI()
+app.state.latency = 0.0
+app.state.fail_rate = 0.0
+app.state.outage_rate = 0.0
+_ttn_numbers = itertools.count(20450000000000)
+_documents = {}
+
+def _ref() -> str:
+    return str(uuid.uuid4())
+
+def _counterparty_save(props):
+    return [{"Ref": _ref(), "Description": f"{props.get('LastName', '')} {props.get('FirstName', '')}".strip(),
+             "ContactPerson": {"data": [{"Ref": _ref()}]}}]
+
+def _document_save(props):
+    number = str(next(_ttn_numbers))
+    estimated = (datetime.now() + timedelta(days=2)).strftime("%d.%m.%Y")
+    document = {"Ref": _ref(), "IntDocNumber": number, "CostOnSite": 70, "EstimatedDeliveryDate": estimated}
+    _documents[number] = {**document, "InfoRegClientBarcodes": props.get("InfoRegClientBarcodes", "")}
+    return [document]
+
+def _document_list(props):
+    # Dates aren't tracked; every document of this run is "in range"
+    return list(_documents.values())
+
+def _tracking(props):
+    return [{"Number": d.get("DocumentNumber"), "Status": "Прибув у відділення", "StatusCode": "7",
+             "CityRecipient": "Київ", "WarehouseRecipient": "Відділення №1"}
+            for d in props.get("Documents", [])]
+
+HANDLERS = {
+    ("Counterparty", "getCounterparties"): lambda p: [{"Ref": "sender-ref", "Description": "ФОП Тест", "City": "city-ref"}],
+    ("Counterparty", "getCounterpartyContactPersons"): lambda p: [{"Ref": "contact-ref"}],
+    ("Counterparty", "getCounterpartyAddresses"): lambda p: [{"Ref": "address-ref"}],
+    ("Counterparty", "save"): _counterparty_save,
+    ("InternetDocument", "save"): _document_save,
+    ("InternetDocument", "getDocumentList"): _document_list,
+    ("TrackingDocument", "getStatusDocuments"): _tracking,
+    ("Address", "getCities"): lambda p: [{"Ref": "city-ref", "Description": "Київ", "AreaDescription": "Київська"}],
+    ("Address", "getWarehouses"): lambda p: [{"Ref": "warehouse-ref", "Description": "Відділення №1", "Number": "1"}],
+}
+
+@app.post("/v2.0/json/")
+async def handle(request: Request):
+    body = await request.json()
+    if app.state.latency:
+        await asyncio.sleep(app.state.latency)
+    if app.state.outage_rate and uuid.uuid4().int % 1000 < app.state.outage_rate * 1000:
+        return PlainTextResponse("Service Unavailable", status_code=503)
+    if app.state.fail_rate and uuid.uuid4().int % 1000 < app.state.fail_rate * 1000:
+        return {"success": False, "data": [], "errors": ["Fake upstream failure"]}
+    handler = HANDLERS.get((body.get("modelName"), body.get("calledMethod")))
+    if handler is None:
+        return {"success": False, "data": [], "errors": [f"Unknown method {body.get('calledMethod')}"]}
+    return {"success": True, "data": handler(body.get("methodProperties") or {}), "errors": []}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0, help="simulated upstream latency")
+    parser.add_argument("--fail-rate", type=float, default=0, help="share of calls answered with success=false")
+    parser.add_argument("--outage-rate", type=float, default=0, help="share of calls answered with HTTP 503")
+    args = parser.parse_args()
+    app.state.latency = args.latency_ms / 1000
+    app.state.fail_rate = args.fail_rate
+    app.state.outage_rate = args.outage_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
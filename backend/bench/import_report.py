@@ -0,0 +1,111 @@
+"""Report where the backend spends its import time.
+
+Imports the module in fresh interpreters: --repeat times to take the median
+wall-clock time, and once with `-X importtime` to break that time down by
+package. Modules listed in --expect-lazy are reported if they were imported
+anyway; they should only load when their endpoint is first used.
+
+    python -m bench.import_report
+    python -m bench.import_report --top 15 --output bench/results/import-<rev>.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# server.py reads these at import time; nothing connects until the first query
+IMPORT_ENV = {"MONGO_URL": "mongodb://localhost:27017", "DB_NAME": "kuvot_bench"}
+
+def run_python(args) -> subprocess.CompletedProcess:
+    env = {**IMPORT_ENV, **os.environ}
+    return subprocess.run([sys.executable, *args], cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+                          check=True)
+
+def import_seconds(module: str) -> float:
+    code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+    return float(run_python(["-c", code]).stdout.strip().splitlines()[-1])
+
+def parse_importtime(stderr: str) -> list:
+    """Rows of (module, depth, self_us, cumulative_us) in the order Python logged them"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nesting is shown as two extra spaces per level after the separator
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+def summarize(rows: list, module: str, top: int, expect_lazy: list) -> dict:
+    target = next((r for r in rows if r[0] == module), None)
+    by_package = defaultdict(int)
+    for name, _, self_us, _ in rows:
+        by_package[name.split(".")[0]] += self_us
+    # Python logs a module after everything it imported, so the direct imports
+    # of the target are the depth-1 rows logged just before it
+    direct = []
+    if target:
+        end = rows.index(target)
+        start = end
+        while start > 0 and rows[start - 1][1] > target[1]:
+            start -= 1
+        direct = [r for r in rows[start:end] if r[1] == target[1] + 1]
+    imported = {name for name, _, _, _ in rows}
+    return {
+        "module": module,
+        "cumulative_ms": round(target[3] / 1000, 1) if target else None,
+        "self_ms": round(target[2] / 1000, 1) if target else None,
+        "modules_imported": len(rows),
+        "slowest_direct_imports": [
+            {"module": name, "cumulative_ms": round(cumulative / 1000, 1)}
+            for name, _, _, cumulative in sorted(direct, key=lambda r: -r[3])[:top]
+        ],
+        "self_time_by_package": [
+            {"package": package, "self_ms": round(total / 1000, 1)}
+            for package, total in sorted(by_package.items(), key=lambda item: -item[1])[:top]
+        ],
+        "unexpected_eager_imports": sorted(
+            name for name in expect_lazy if name in imported or any(m.startswith(name + ".") for m in imported)
+        ),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="server")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters timed for the median")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--expect-lazy", default="openpyxl,httpx",
+                        help="comma-separated modules that must not be imported at startup")
+    parser.add_argument("--output", default="", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    timings = [import_seconds(args.module) for _ in range(args.repeat)]
+    rows = parse_importtime(run_python(["-X", "importtime", "-c", f"import {args.module}"]).stderr)
+    expect_lazy = [name for name in args.expect_lazy.split(",") if name]
+    report = {"median_import_ms": round(statistics.median(timings) * 1000, 1),
+              **summarize(rows, args.module, args.top, expect_lazy)}
+
+    print(f"import {args.module}: median {report['median_import_ms']} ms over {args.repeat} runs, "
+          f"{report['modules_imported']} modules (-X importtime: {report['cumulative_ms']} ms, "
+          f"{report['self_ms']} ms in {args.module} itself)")
+    print("slowest direct imports:")
+    for row in report["slowest_direct_imports"]:
+        print(f"  {row['module']:<40} {row['cumulative_ms']:>8.1f} ms")
+    print("self time by package:")
+    for row in report["self_time_by_package"]:
+        print(f"  {row['package']:<40} {row['self_ms']:>8.1f} ms")
+    if report["unexpected_eager_imports"]:
+        print(f"imported at startup but expected lazy: {', '.join(report['unexpected_eager_imports'])}")
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""Load-test the hot API endpoints against a local MongoDB.
+
+Seeds synthetic orders, starts the fake Nova Poshta API and the backend with
+uvicorn, then runs each scenario with a fixed number of concurrent clients and
+writes throughput and latency percentiles as JSON.
+
+    python -m bench.run --sizes 10000,100000 --duration 15 --concurrency 8
+    python -m bench.compare bench/results/<old>.json bench/results/<new>.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+
+from bench.seed import seed
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+READ_SCENARIOS = ["get_orders", "get_analytics_summary", "get_analytics_range", "get_daily_analytics",
+                  "export_to_excel"]
+WRITE_SCENARIOS = ["create_order", "create_ttn", "track_ttn"]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def git_revision() -> str:
+    try:
+        rev = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"], cwd=BACKEND_DIR).returncode != 0
+        return rev + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def start_process(args, env=None) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], cwd=BACKEND_DIR, env={**os.environ, **(env or {})})
+
+async def wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up in {timeout}s")
+
+def order_payload(rng: random.Random, order_date: str) -> dict:
+    return {
+        "order_date": order_date,
+        "painting_name": f"Бенчмарк #{rng.randint(1, 10**6)}",
+        "order_type": "друк",
+        "items": [{"size": "40х50", "quantity": 1, "unit_price": 1050, "unit_cost": 290,
+                   "with_lacquer": True, "lacquer_price": 120, "lacquer_cost": 35}],
+        "sales_channel": "Instagram",
+        "status": "нове",
+    }
+
+def ttn_payload() -> dict:
+    return {
+        "recipient_name": "Шевченко Тарас Григорович",
+        "recipient_phone": "380501234567",
+        "recipient_city_ref": "city-ref",
+        "recipient_city_name": "Київ",
+        "recipient_warehouse_ref": "warehouse-ref",
+        "recipient_warehouse_name": "Відділення №1",
+        "weight": 1.2, "length": 55, "width": 45, "height": 6,
+        "description": "Картина", "cost": 1050,
+    }
+
+def random_range(ctx: dict, rng: random.Random) -> dict:
+    """Random 1-90 day range within the seeded span; repeats are rare, so it measures cache misses"""
+    latest = date.fromisoformat(ctx["date"])
+    days = rng.randint(1, 90)
+    end = latest - timedelta(days=rng.randrange(max(ctx["span_days"] - days, 1)))
+    return {"start_date": (end - timedelta(days=days - 1)).isoformat(), "end_date": end.isoformat()}
+
+def build_request(name: str, ctx: dict, rng: random.Random):
+    if name == "get_orders":
+        return "GET", "/api/orders", {"params": {"month": ctx["month"]}}
+    if name == "get_analytics_summary":
+        return "GET", "/api/analytics/summary", {"params": {"month": ctx["month"]}}
+    if name == "get_analytics_range":
+        return "GET", "/api/analytics/summary", {"params": random_range(ctx, rng)}
+    if name == "get_daily_analytics":
+        return "GET", "/api/analytics/daily", {"params": {"date_str": ctx["date"]}}
+    if name == "export_to_excel":
+        return "GET", "/api/export/excel", {"params": {"month": ctx["month"]}}
+    if name == "create_order":
+        return "POST", "/api/orders", {"json": order_payload(rng, ctx["date"])}
+    if name == "create_ttn":
+        return "POST", "/api/nova-poshta/ttn", {"json": ttn_payload()}
+    if name == "track_ttn":
+        return "GET", f"/api/nova-poshta/track/{ctx['ttn_number']}", {}
+    raise ValueError(name)
+
+async def wait_for_job(client: httpx.AsyncClient, job_id: str, timeout: float = 60) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = (await client.get(f"/api/nova-poshta/jobs/{job_id}")).json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"Nova Poshta job {job_id} did not finish in {timeout}s")
+
+async def run_scenario(client: httpx.AsyncClient, name: str, ctx: dict, concurrency: int,
+                       duration: float, max_requests: int, warmup: int) -> dict:
+    rng = random.Random(name)
+    for _ in range(warmup):
+        method, path, kwargs = build_request(name, ctx, rng)
+        await client.request(method, path, **kwargs)
+
+    # Only successful responses are timed: fast 503s from the concurrency
+    # limiter would otherwise pull the percentiles down and the throughput up
+    latencies, errors, rejected, sent = [], 0, 0, 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors, rejected, sent
+        while time.perf_counter() < deadline and (not max_requests or sent < max_requests):
+            sent += 1
+            method, path, kwargs = build_request(name, ctx, rng)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            if response.status_code == 503:
+                rejected += 1
+                # Back off like a real client instead of spinning on fast rejections
+                retry_after = float(response.headers.get("Retry-After", 0))
+                await asyncio.sleep(max(0.0, min(retry_after, deadline - time.perf_counter())))
+            elif response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies) + errors + rejected,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "rejected": rejected,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0,
+    }
+
+async def bench_size(args, size: int, scenarios) -> dict:
+    if args.skip_seed:
+        seeded = seed(args.mongo_url, args.db, 0, args.months)
+    else:
+        seeded = seed(args.mongo_url, args.db, size, args.months, drop=True)
+    ctx = {"month": seeded["latest_month"], "date": seeded["latest_date"], "span_days": args.months * 30}
+
+    np_port, api_port = free_port(), free_port()
+    fake_np = start_process(["-m", "bench.fake_nova_poshta", "--port", str(np_port),
+                             "--latency-ms", str(args.np_latency_ms)])
+    server = start_process(["-m", "uvicorn", "server:app", "--port", str(api_port), "--log-level", "warning"], env={
+        "MONGO_URL": args.mongo_url,
+        "DB_NAME": args.db,
+        "NOVA_POSHTA_API_URL": f"http://127.0.0.1:{np_port}/v2.0/json/",
+        "NOVA_POSHTA_API_KEY": "bench",
+    })
+    try:
+        base_url = f"http://127.0.0.1:{api_port}"
+        await wait_ready(f"http://127.0.0.1:{np_port}/docs")
+        await wait_ready(f"{base_url}/api/")
+        limits = httpx.Limits(max_connections=args.concurrency * 2)
+        async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+            await client.post("/api/prices/seed")
+            await client.post("/api/nova-poshta/settings", params={"api_key": "bench", "sender_phone": "380500000000"})
+            job = (await client.post("/api/nova-poshta/ttn", json=ttn_payload())).json()
+            ttn = (await wait_for_job(client, job["id"])).get("result") or {}
+            ctx["ttn_number"] = ttn.get("ttn_number", "20450000000000")
+
+            results = {}
+            for name in scenarios:
+                results[name] = await run_scenario(client, name, ctx, args.concurrency, args.duration,
+                                                   args.requests, args.warmup)
+                r = results[name]
+                print(f"  {name:<24} {r['throughput_rps']:>9.1f} req/s  p50 {r['p50_ms']:>8.1f} ms  "
+                      f"p99 {r['p99_ms']:>8.1f} ms  errors {r['errors']}  rejected {r['rejected']}")
+        return {"orders": size, "context": ctx, "scenarios": results}
+    finally:
+        for proc in (server, fake_np):
+            proc.terminate()
+            proc.wait(timeout=10)
+
+async def main_async(args):
+    scenarios = args.scenarios.split(",") if args.scenarios else READ_SCENARIOS + WRITE_SCENARIOS
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "np_latency_ms": args.np_latency_ms,
+        },
+        "runs": [],
+    }
+    for size in [int(s) for s in args.sizes.split(",")]:
+        print(f"== {size} orders ==")
+        report["runs"].append(await bench_size(args, size, scenarios))
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{report['meta']['revision']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Results written to {output}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.environ.get("BENCH_MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="kuvot_bench")
+    parser.add_argument("--sizes", default="10000", help="comma-separated order counts, e.g. 10000,100000,1000000")
+    parser.add_argument("--months", type=int, default=24, help="months the synthetic orders are spread over")
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the orders already in --db")
+    parser.add_argument("--scenarios", default="", help="comma-separated subset of: " +
+                        ",".join(READ_SCENARIOS + WRITE_SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument("--requests", type=int, default=0, help="cap requests per scenario (0 = duration only)")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--np-latency-ms", type=float, default=50, help="fake Nova Poshta latency")
+    parser.add_argument("--output", default="", help="defaults to bench/results/<git revision>.json")
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Seed a MongoDB database with synthetic orders for benchmarking.
+
+Orders are dated with UI-style timestamps and stored the way the server
+stores them (compact schema plus search fields). --legacy writes the
+pre-compaction shape instead, to measure migrations/compact_orders.
+
+    python -m bench.seed --orders 100000 --db kuvot_bench --drop
+    python -m bench.seed --orders 100000 --db kuvot_bench --drop --legacy
+"""
+import argparse
+import os
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import MongoClient
+
+# server.py reads these at import; only its storage helpers are used here
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "kuvot_bench")
+from server import compact_order, inflate_order, search_fields  # noqa: E402
+
+MONTHS_UA = ["Січень", "Лютий", "Березень", "Квітень", "Травень", "Червень",
+             "Липень", "Серпень", "Вересень", "Жовтень", "Листопад", "Грудень"]
+
+# size: (cost, sell, lacquer cost/price, packaging cost/price, frame 1-10 cost/price, frame 11-14 cost/price)
+PRICES = {
+    "20х30": (170, 420, 30, 80, 30, 90, 180, 360, 130, 260),
+    "30х40": (240, 650, 30, 100, 30, 110, 250, 490, 180, 380),
+    "40х50": (290, 1050, 35, 120, 35, 130, 325, 650, 235, 470),
+    "40х60": (340, 1180, 40, 120, 35, 130, 360, 720, 260, 520),
+    "50х70": (425, 1380, 50, 130, 60, 140, 430, 860, 310, 620),
+    "60х80": (575, 1750, 70, 140, 65, 150, 505, 1010, 365, 730),
+    "70х100": (835, 2050, 90, 180, 135, 210, 610, 1220, 440, 830),
+    "80х120": (1145, 2490, 120, 230, 140, 260, 720, 1440, 520, 1040),
+}
+ORDER_TYPES = [("друк", 70), ("цифрова", 20), ("оригінал", 10)]
+CHANNELS = [("Instagram", 60), ("Messenger", 15), ("Viber/Telegram", 25)]
+STATUSES = [("виконано", 60), ("оплачено", 15), ("нове", 15), ("скасовано", 10)]
+SUBJECTS = ["Соняшники", "Портрет", "Київ вночі", "Карпати", "Море", "Кіт", "Квіти у вазі",
+            "Собака", "Весілля", "Абстракція", "Львівська кавʼярня", "Ґражда", "Захід сонця"]
+COMMENTS = [None, None, None, "терміново", "подарунок", "доставка Укрпоштою", "повторне замовлення"]
+
+def weighted(rng: random.Random, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights=weights)[0]
+
+def make_item(rng: random.Random) -> dict:
+    size = rng.choice(list(PRICES))
+    (cost, sell, lac_cost, lac_price, pack_cost, pack_price,
+     f110_cost, f110_price, f1114_cost, f1114_price) = PRICES[size]
+    quantity = rng.choices([1, 2, 3], weights=[85, 12, 3])[0]
+    with_lacquer = rng.random() < 0.3
+    with_packaging = rng.random() < 0.5
+    frame_type = rng.choices([None, "1-10", "11-14"], weights=[60, 25, 15])[0]
+    frame_price, frame_cost = {
+        None: (0, 0), "1-10": (f110_price, f110_cost), "11-14": (f1114_price, f1114_cost)
+    }[frame_type]
+
+    item = {
+        "size": size,
+        "product_id": None,
+        "product_name": None,
+        "quantity": quantity,
+        "unit_price": sell,
+        "unit_cost": cost,
+        "with_lacquer": with_lacquer,
+        "with_packaging": with_packaging,
+        "frame_type": frame_type,
+        "lacquer_price": lac_price if with_lacquer else 0,
+        "lacquer_cost": lac_cost if with_lacquer else 0,
+        "packaging_price": pack_price if with_packaging else 0,
+        "packaging_cost": pack_cost if with_packaging else 0,
+        "frame_price": frame_price,
+        "frame_cost": frame_cost,
+    }
+    # Same arithmetic as server.calculate_order_totals
+    total_price = (sell + item["lacquer_price"] + item["packaging_price"] + frame_price) * quantity
+    total_cost = (cost + item["lacquer_cost"] + item["packaging_cost"] + frame_cost) * quantity
+    item.update({"total_price": total_price, "total_cost": total_cost, "profit": total_price - total_cost})
+    return item
+
+def make_order(rng: random.Random, order_date: datetime) -> dict:
+    items = [make_item(rng) for _ in range(rng.choices([1, 2, 3], weights=[75, 20, 5])[0])]
+    total_amount = sum(i["total_price"] for i in items)
+    total_cost = sum(i["total_cost"] for i in items)
+    discounted_amount = round(total_amount * 0.9) if rng.random() < 0.15 else None
+    extra_income = rng.choice([0, 0, 0, 50, 100])
+    final_amount = discounted_amount if discounted_amount else total_amount
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        # Date.toISOString(), as the order form sends it
+        "order_date": order_date.isoformat(timespec="milliseconds") + "Z",
+        "month": f"{MONTHS_UA[order_date.month - 1]} {order_date.year}",
+        "painting_name": f"{rng.choice(SUBJECTS)} #{rng.randint(1, 999)}",
+        "order_type": weighted(rng, ORDER_TYPES),
+        "items": items,
+        "total_amount": total_amount,
+        "total_cost": total_cost,
+        "profit": total_amount - total_cost,
+        "sales_channel": weighted(rng, CHANNELS),
+        "status": weighted(rng, STATUSES),
+        "comment": rng.choice(COMMENTS),
+        "created_at": order_date.replace(tzinfo=timezone.utc).isoformat(),
+        "extra_income": extra_income,
+        "discounted_amount": discounted_amount,
+        "discount": total_amount - discounted_amount if discounted_amount else 0,
+        "net_income": final_amount + extra_income - total_cost,
+    }
+
+def stored_order(order: dict, legacy: bool) -> dict:
+    return order if legacy else {**compact_order(order), **search_fields(order)}
+
+def seed(mongo_url: str, db_name: str, orders: int, months: int, seed_value: int = 42,
+         drop: bool = False, batch_size: int = 5000, legacy: bool = False) -> dict:
+    """Insert `orders` synthetic orders spread over the last `months` months"""
+    rng = random.Random(seed_value)
+    client = MongoClient(mongo_url)
+    db = client[db_name]
+    if drop:
+        db.orders.drop()
+        db.ttns.drop()
+
+    end = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    span_days = max(months * 30, 1)
+    batch = []
+    for _ in range(orders):
+        order_date = end - timedelta(days=rng.randrange(span_days), seconds=rng.randrange(24 * 3600))
+        batch.append(stored_order(make_order(rng, order_date), legacy))
+        if len(batch) >= batch_size:
+            db.orders.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.orders.insert_many(batch, ordered=False)
+
+    # BSON sorts dates after strings, so with mixed shapes this is the latest
+    # compact order; inflating gives month and date for either shape
+    latest = inflate_order(db.orders.find_one(
+        {}, {"_id": 0, "month": 1, "order_date": 1, "_v": 1, "_ts": 1}, sort=[("order_date", -1)]
+    ))
+    client.close()
+    return {"orders": orders, "latest_month": latest["month"], "latest_date": latest["order_date"][:10]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="kuvot_bench")
+    parser.add_argument("--orders", type=int, default=10000)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--drop", action="store_true", help="drop orders and ttns first")
+    parser.add_argument("--legacy", action="store_true", help="write the pre-compaction document shape")
+    args = parser.parse_args()
+    print(seed(args.mongo_url, args.db, args.orders, args.months, args.seed, args.drop, legacy=args.legacy))
+
+if __name__ == "__main__":
+    main()
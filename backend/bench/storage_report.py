@@ -0,0 +1,69 @@
+"""Report order document sizes and full-scan times.
+
+Run before and after `python -m migrations.compact_orders` to compare storage
+schemas. Scan times are the median of --repeat full reads of the collection:
+once as raw BSON iteration and once inflated to the API shape, the way
+analytics and exports consume orders.
+
+    python -m bench.storage_report --db kuvot_bench --output bench/results/storage-before.json
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from pathlib import Path
+
+from pymongo import MongoClient
+
+from server import ORDER_PROJECTION, inflate_order
+
+def timed_scan(collection, inflate: bool, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for doc in collection.find({}, ORDER_PROJECTION, batch_size=1000):
+            if inflate:
+                inflate_order(doc)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def report_collection(db, name: str, repeat: int) -> dict:
+    stats = db.command("collStats", name)
+    sizes = next(db[name].aggregate([
+        {"$project": {"size": {"$bsonSize": "$$ROOT"}, "compact": {"$eq": ["$_v", 2]}}},
+        {"$group": {"_id": None, "avg": {"$avg": "$size"}, "max": {"$max": "$size"},
+                    "compact": {"$sum": {"$cond": ["$compact", 1, 0]}}}},
+    ]), {"avg": 0, "max": 0, "compact": 0})
+    return {
+        "documents": stats.get("count", 0),
+        "compact_documents": sizes["compact"],
+        "avg_document_bytes": round(sizes["avg"] or 0, 1),
+        "max_document_bytes": sizes["max"],
+        "data_bytes": stats.get("size", 0),
+        "storage_bytes": stats.get("storageSize", 0),
+        "index_bytes": stats.get("totalIndexSize", 0),
+        "scan_seconds": round(timed_scan(db[name], False, repeat), 4),
+        "scan_inflate_seconds": round(timed_scan(db[name], True, repeat), 4),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.environ.get("BENCH_MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="kuvot_bench")
+    parser.add_argument("--collection", default="orders")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_url)
+    report = report_collection(client[args.db], args.collection, args.repeat)
+    client.close()
+    for key, value in report.items():
+        print(f"  {key:<22} {value}")
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
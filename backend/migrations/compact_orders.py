@@ -0,0 +1,93 @@
+"""Rewrite stored orders into the compact schema (see ORDER STORAGE in server.py).
+
+Streams the hot `orders` collection and every archive partition in `_id` order
+and replaces legacy documents in batches. Progress is checkpointed per
+collection in `migrations`, so an interrupted run continues where it stopped;
+documents already compacted (by the server or an earlier run) are skipped.
+The server reads both shapes, so it can keep running during the migration.
+
+    python -m migrations.compact_orders --batch-size 1000
+    python -m migrations.compact_orders --dry-run        # count and measure only
+    python -m migrations.compact_orders --restart        # ignore checkpoints
+
+Measure before and after with `python -m bench.storage_report`.
+"""
+import argparse
+import os
+import time
+
+import bson
+from pymongo import MongoClient, ReplaceOne
+
+from server import ORDER_SCHEMA_VERSION, archive_collection, compact_order
+
+CHECKPOINT_PREFIX = "compact_orders:"
+
+def order_collections(db) -> list:
+    names = ["orders"]
+    names += [archive_collection(p["_id"]) for p in db.order_archive_partitions.find({}, {"_id": 1}).sort("_id", 1)]
+    return names
+
+def migrate_collection(db, name: str, batch_size: int, dry_run: bool, restart: bool) -> dict:
+    checkpoint_id = CHECKPOINT_PREFIX + name
+    checkpoint = None if restart else db.migrations.find_one({"_id": checkpoint_id})
+    last_id = checkpoint.get("last_id") if checkpoint else None
+    stats = {"collection": name, "migrated": 0, "bytes_before": 0, "bytes_after": 0, "resumed_after": last_id}
+
+    def flush(batch):
+        if not dry_run:
+            # Only replace documents still in the legacy shape, so orders the
+            # server rewrote meanwhile are never clobbered with stale data
+            db[name].bulk_write([
+                ReplaceOne({"_id": doc["_id"], "_v": {"$ne": ORDER_SCHEMA_VERSION}}, compact)
+                for doc, compact in batch
+            ], ordered=False)
+            db.migrations.update_one({"_id": checkpoint_id}, {
+                "$set": {"last_id": batch[-1][0]["_id"], "updated_at": time.time()},
+                "$inc": {"migrated": len(batch)},
+            }, upsert=True)
+        stats["migrated"] += len(batch)
+
+    # Keyset pagination on _id: no cursor has to stay open for the whole run
+    while True:
+        query = {"_v": {"$ne": ORDER_SCHEMA_VERSION}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        docs = list(db[name].find(query).sort("_id", 1).limit(batch_size))
+        if not docs:
+            return stats
+        batch = []
+        for doc in docs:
+            compact = compact_order(doc)
+            stats["bytes_before"] += len(bson.encode(doc))
+            stats["bytes_after"] += len(bson.encode({"_id": doc["_id"], **compact}))
+            batch.append((doc, compact))
+        flush(batch)
+        last_id = docs[-1]["_id"]
+        print(f"  {name}: {stats['migrated']} migrated", flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default=os.environ.get("DB_NAME"))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--restart", action="store_true", help="ignore saved checkpoints")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_url)
+    db = client[args.db]
+    started = time.perf_counter()
+    for name in order_collections(db):
+        stats = migrate_collection(db, name, args.batch_size, args.dry_run, args.restart)
+        if stats["migrated"]:
+            saved = 1 - stats["bytes_after"] / stats["bytes_before"]
+            print(f"{name}: {stats['migrated']} documents, {stats['bytes_before']} -> {stats['bytes_after']} bytes "
+                  f"({saved:.0%} smaller)")
+        else:
+            print(f"{name}: nothing to migrate")
+    print(f"done in {time.perf_counter() - started:.1f}s{' (dry run)' if args.dry_run else ''}")
+    client.close()
+
+if __name__ == "__main__":
+    main()
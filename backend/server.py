@@ -1,30 +1,349 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Header, Depends
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse, FileResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring, read_preferences, ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
+import asyncio
+import hashlib
+import hmac
+import re
+import sys
+import unicodedata
+from bisect import bisect_right
+from functools import lru_cache
+import json
+import threading
+import time
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
+from typing import TYPE_CHECKING, List, Optional, Dict, Any, Tuple
+from collections import OrderedDict
 import uuid
-from datetime import datetime, timezone, date
+from datetime import datetime, timezone, date, timedelta
 from io import BytesIO
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-import httpx
+from urllib.parse import parse_qs, quote
+# openpyxl and httpx are imported where they are used, to keep cold start fast
+if TYPE_CHECKING:
+    import httpx
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# ========== METRICS ==========
+
+# Minimal Prometheus text-format registry so /metrics has no runtime dependency
+METRICS_REGISTRY: List["Metric"] = []
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(label_names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape_label(v)}"' for n, v in zip(label_names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: Dict[tuple, Any] = {}
+        # Mongo command events arrive on pymongo's threads, not the event loop
+        self._lock = threading.Lock()
+        METRICS_REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> tuple:
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def label_sets(self) -> List[Dict[str, str]]:
+        """Labels of every series recorded so far"""
+        with self._lock:
+            keys = list(self._values)
+        return [dict(zip(self.label_names, key)) for key in keys]
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), buckets: tuple = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.label_names, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            inf_labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served", ("method",))
+HTTP_QUEUE_WAIT = Histogram(
+    "http_queue_wait_seconds", "Time requests waited for a concurrency slot", ("route_class",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+HTTP_QUEUE_DEPTH = Gauge(
+    "http_queue_depth", "Requests waiting for a concurrency slot", ("route_class",))
+HTTP_ROUTE_CLASS_IN_FLIGHT = Gauge(
+    "http_route_class_in_flight", "Requests holding a concurrency slot", ("route_class",))
+HTTP_REJECTED = Counter(
+    "http_requests_rejected_total", "Requests turned away by concurrency limits", ("route_class", "reason"))
+MONGO_COMMAND_DURATION = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ("command", "collection"))
+MONGO_COMMAND_ERRORS = Counter(
+    "mongodb_command_errors_total", "Failed MongoDB commands", ("command", "collection"))
+NOVA_POSHTA_DURATION = Histogram(
+    "nova_poshta_request_duration_seconds", "Nova Poshta API latency", ("model_name", "called_method"))
+NOVA_POSHTA_ERRORS = Counter(
+    "nova_poshta_request_errors_total", "Failed Nova Poshta API calls", ("model_name", "called_method", "reason"))
+NOVA_POSHTA_JOBS = Counter(
+    "nova_poshta_jobs_total", "Nova Poshta jobs by kind and outcome", ("kind", "outcome"))
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache lookups by result", ("cache", "result"))
+CACHE_HIT_RATIO = Gauge(
+    "cache_hit_ratio", "Share of cache lookups served from cache", ("cache",))
+
+def render_metrics() -> str:
+    # Hit ratios are derived from the lookup counters at scrape time
+    caches = {labels["cache"] for labels in CACHE_REQUESTS.label_sets()}
+    for cache in caches:
+        # Requests that joined an in-flight computation didn't compute either
+        hits = CACHE_REQUESTS.value(cache=cache, result="hit") + CACHE_REQUESTS.value(cache=cache, result="coalesced")
+        total = hits + CACHE_REQUESTS.value(cache=cache, result="miss")
+        CACHE_HIT_RATIO.set(hits / total if total else 0, cache=cache)
+    lines = []
+    for metric in METRICS_REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Records timings of every command sent by the Motor client"""
+
+    def __init__(self):
+        self._pending: Dict[tuple, tuple] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection", "")
+        self._pending[(event.connection_id, event.request_id)] = (event.command_name, collection)
+
+    def _finish(self, event) -> tuple:
+        return self._pending.pop((event.connection_id, event.request_id), (event.command_name, ""))
+
+    def succeeded(self, event):
+        command, collection = self._finish(event)
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, command=command, collection=collection)
+
+    def failed(self, event):
+        command, collection = self._finish(event)
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, command=command, collection=collection)
+        MONGO_COMMAND_ERRORS.inc(command=command, collection=collection)
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and in-flight requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(method=method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec(method=method)
+            # Label by route template, not raw path, to keep cardinality bounded
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_DURATION.observe(elapsed, method=method, route=route_path)
+            HTTP_REQUESTS.inc(method=method, route=route_path, status=status["code"])
+
+# ========== DATABASE ==========
+
+READ_PREFERENCES = {
+    "primary": read_preferences.Primary,
+    "primaryPreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondaryPreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+
+def make_read_preference(mode: str, max_staleness: int):
+    if mode == "primary":
+        return read_preferences.Primary()
+    # Mongo requires maxStalenessSeconds >= 90; -1 means no limit
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client_options = {
+    "maxPoolSize": int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+    "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+}
+# e.g. "zstd,snappy,zlib"; zstd needs `zstandard` and snappy `python-snappy` installed
+if os.environ.get('MONGO_COMPRESSORS'):
+    client_options["compressors"] = os.environ['MONGO_COMPRESSORS']
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandMetrics()], **client_options)
 db = client[os.environ['DB_NAME']]
 
+# Heavy read-only reporting and export scans go to secondaries when there are any
+REPORTING_READ_PREFERENCE = os.environ.get('MONGO_REPORTING_READ_PREFERENCE', 'secondaryPreferred')
+REPORTING_MAX_STALENESS_SECONDS = int(os.environ.get('MONGO_REPORTING_MAX_STALENESS_SECONDS', -1))
+reporting_db = client.get_database(
+    os.environ['DB_NAME'],
+    read_preference=make_read_preference(REPORTING_READ_PREFERENCE, REPORTING_MAX_STALENESS_SECONDS)
+)
+
 # Nova Poshta API configuration
 NOVA_POSHTA_API_KEY = os.environ.get('NOVA_POSHTA_API_KEY', '')
-NOVA_POSHTA_API_URL = "https://api.novaposhta.ua/v2.0/json/"
+NOVA_POSHTA_API_URL = os.environ.get('NOVA_POSHTA_API_URL', "https://api.novaposhta.ua/v2.0/json/")
+
+# Nova Poshta job queue: TTN creation runs in background workers with retries
+NP_JOB_WORKERS = int(os.environ.get('NP_JOB_WORKERS', 2))
+NP_JOB_MAX_ATTEMPTS = int(os.environ.get('NP_JOB_MAX_ATTEMPTS', 6))
+NP_JOB_BACKOFF_SECONDS = float(os.environ.get('NP_JOB_BACKOFF_SECONDS', 2))
+NP_JOB_BACKOFF_MAX_SECONDS = float(os.environ.get('NP_JOB_BACKOFF_MAX_SECONDS', 300))
+# A running job whose worker died is picked up again after this long; it has
+# to outlast the Nova Poshta calls of one attempt (30s timeout each)
+NP_JOB_LEASE_SECONDS = int(os.environ.get('NP_JOB_LEASE_SECONDS', 120))
+NP_JOB_POLL_SECONDS = float(os.environ.get('NP_JOB_POLL_SECONDS', 1))
+NP_JOB_TTL_SECONDS = int(os.environ.get('NP_JOB_TTL_SECONDS', 30 * 24 * 3600))
+# Nova Poshta settings are cached in memory; other processes see a save after this long
+NP_SETTINGS_TTL_SECONDS = float(os.environ.get('NP_SETTINGS_TTL_SECONDS', 60))
+
+# Index creation and backfills at startup are retried this often until MongoDB is reachable
+STARTUP_RETRY_SECONDS = float(os.environ.get('STARTUP_RETRY_SECONDS', 30))
+
+# Idempotency-Key configuration
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 30))
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', 120))
+
+# Analytics result cache
+ANALYTICS_CACHE_TTL_SECONDS = float(os.environ.get('ANALYTICS_CACHE_TTL_SECONDS', 300))
+ANALYTICS_CACHE_MAX_ENTRIES = int(os.environ.get('ANALYTICS_CACHE_MAX_ENTRIES', 256))
+# Results computed this soon after an order write aren't cached, since the
+# secondary they were read from may not have replicated the write yet
+ANALYTICS_CACHE_SETTLE_SECONDS = float(os.environ.get(
+    'ANALYTICS_CACHE_SETTLE_SECONDS', 0 if REPORTING_READ_PREFERENCE == "primary" else 2
+))
+
+# In-memory effective-dated price index; reloaded after price writes or this long
+PRICE_INDEX_TTL_SECONDS = float(os.environ.get('PRICE_INDEX_TTL_SECONDS', 300))
+# Effective date given to prices that predate the history
+PRICE_HISTORY_EPOCH = "1970-01-01"
+
+# Dashboard bootstrap batching
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', 20))
+
+# Upper bound on orders a single bulk status change may touch
+BULK_STATUS_MAX_ORDERS = int(os.environ.get('BULK_STATUS_MAX_ORDERS', 5000))
+
+# Order search: edge n-gram bounds for prefix autocomplete
+SEARCH_PREFIX_MIN = 2
+SEARCH_PREFIX_MAX = 15
+
+# Hot/cold order storage: closed orders older than N months move to monthly partitions
+ARCHIVE_AFTER_MONTHS = int(os.environ.get('ARCHIVE_AFTER_MONTHS', 3))
+ARCHIVE_STATUSES = ["виконано", "скасовано"]
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000))
+
+# Admin-only request profiling; disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', ROOT_DIR / 'profiles'))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_SECONDS', 0.005))
+
+def concurrency_settings(route_class: str, limit: int, queue: int, queue_timeout: float, retry_after: int) -> Dict:
+    prefix = f"CONCURRENCY_{route_class.upper()}_"
+    return {
+        "limit": int(os.environ.get(prefix + "LIMIT", limit)),
+        "queue": int(os.environ.get(prefix + "QUEUE", queue)),
+        "queue_timeout": float(os.environ.get(prefix + "QUEUE_TIMEOUT", queue_timeout)),
+        "retry_after": int(os.environ.get(prefix + "RETRY_AFTER", retry_after)),
+    }
+
+# Per route class: concurrent requests, how many more may queue, how long they
+# may wait, and the Retry-After sent with the 503 when they can't. Override
+# with e.g. CONCURRENCY_EXPORT_LIMIT=4; a limit of 0 turns the class off.
+CONCURRENCY_LIMITS = {
+    "export": concurrency_settings("export", 2, 4, 30, 10),
+    "analytics": concurrency_settings("analytics", 8, 32, 10, 2),
+    "nova_poshta": concurrency_settings("nova_poshta", 8, 32, 10, 2),
+    "crud": concurrency_settings("crud", 64, 256, 5, 1),
+}
 
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
@@ -59,6 +378,22 @@ class PriceItemCreate(BaseModel):
     frame_11_14_cost: float = 0
     frame_11_14_price: float = 0
 
+class PriceHistoryEntry(PriceItemCreate):
+    """A price as set from effective_from on; deleted entries end a size's pricing"""
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    price_id: str
+    effective_from: str
+    recorded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    deleted: bool = False
+
+class PriceLookup(BaseModel):
+    size: str
+    date_str: str
+
+class PriceLookupBatch(BaseModel):
+    lookups: List[PriceLookup]
+
 class Product(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -138,39 +473,394 @@ class OrderUpdate(BaseModel):
     extra_income: Optional[float] = None
     discounted_amount: Optional[float] = None
 
+class BulkStatusFilter(BaseModel):
+    month: Optional[str] = None
+    order_date: Optional[str] = None
+    order_type: Optional[str] = None
+    size: Optional[str] = None
+    status: Optional[str] = None
+    sales_channel: Optional[str] = None
+
+class BulkStatusUpdate(BaseModel):
+    status: str
+    ids: Optional[List[str]] = None
+    filter: Optional[BulkStatusFilter] = None
+
+# ========== IDEMPOTENCY ==========
+
+# Events for keys currently being processed by this worker, so concurrent
+# duplicates can wait without polling Mongo
+_idempotency_inflight: Dict[str, asyncio.Event] = {}
+
+def request_fingerprint(payload: BaseModel) -> str:
+    raw = json.dumps(jsonable_encoder(payload), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+async def run_idempotent(scope: str, key: Optional[str], payload: BaseModel, handler, status_code: int = 200):
+    """Run handler once per (scope, Idempotency-Key).
+
+    Retries with the same key get the stored response back, with the route's
+    success status_code; concurrent duplicates wait for the first request to
+    finish. A failed request releases the key so the client can retry it.
+    """
+    if not key:
+        return await handler()
+
+    record_id = f"{scope}:{key}"
+    fingerprint = request_fingerprint(payload)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + IDEMPOTENCY_WAIT_SECONDS
+
+    while True:
+        try:
+            await db.idempotency_keys.insert_one({
+                "_id": record_id,
+                "fingerprint": fingerprint,
+                "status": "processing",
+                "created_at": datetime.now(timezone.utc)
+            })
+            break
+        except DuplicateKeyError:
+            pass
+
+        record = await db.idempotency_keys.find_one({"_id": record_id})
+        if not record:
+            # The first request failed and released the key
+            continue
+        if record.get("fingerprint") != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key вже використано з іншими даними")
+        if record.get("status") == "completed":
+            CACHE_REQUESTS.inc(cache="idempotency", result="hit")
+            return JSONResponse(
+                status_code=record.get("status_code", 200),
+                content=record.get("response"),
+                headers={"Idempotent-Replayed": "true"}
+            )
+
+        # Take over keys left in "processing" by a crashed worker
+        stale = await db.idempotency_keys.delete_one({
+            "_id": record_id,
+            "status": "processing",
+            "created_at": {"$lt": datetime.now(timezone.utc) - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}
+        })
+        if stale.deleted_count:
+            continue
+
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise HTTPException(status_code=409, detail="Запит з цим Idempotency-Key ще виконується")
+        event = _idempotency_inflight.get(record_id)
+        try:
+            if event:
+                await asyncio.wait_for(event.wait(), timeout=remaining)
+            else:
+                await asyncio.sleep(min(0.2, remaining))
+        except asyncio.TimeoutError:
+            pass
+
+    CACHE_REQUESTS.inc(cache="idempotency", result="miss")
+    event = _idempotency_inflight[record_id] = asyncio.Event()
+    try:
+        result = await handler()
+    except BaseException:
+        await db.idempotency_keys.delete_one({"_id": record_id})
+        raise
+    finally:
+        _idempotency_inflight.pop(record_id, None)
+        event.set()
+
+    await db.idempotency_keys.update_one(
+        {"_id": record_id},
+        {"$set": {"status": "completed", "status_code": status_code, "response": jsonable_encoder(result)}}
+    )
+    return result
+
 # ========== PRICE CATALOG ==========
 
+# price_catalog holds the current price per size; price_history keeps every
+# price with the date it took effect, so orders can be priced as of their date.
+
+class PriceHistoryIndex:
+    """In-memory as-of lookup over price_history.
+
+    Per size, effective dates are kept sorted next to the entries in force from
+    them, so a lookup is one bisect. The whole history is small enough to hold
+    in memory; it is reloaded after price writes or every `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._dates: Dict[str, List[str]] = {}
+        self._entries: Dict[str, List[Optional[Dict[str, Any]]]] = {}
+        self._expires_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    async def ensure_loaded(self):
+        if time.monotonic() < self._expires_at:
+            return
+        async with self._lock:
+            if time.monotonic() < self._expires_at:
+                return
+            dates, entries = {}, {}
+            cursor = db.price_history.find({}, {"_id": 0}).sort([("effective_from", 1), ("recorded_at", 1)])
+            async for entry in cursor:
+                size_dates = dates.setdefault(entry["size"], [])
+                size_entries = entries.setdefault(entry["size"], [])
+                value = None if entry.get("deleted") else entry
+                # Of entries effective the same day, the last recorded wins
+                if size_dates and size_dates[-1] == entry["effective_from"]:
+                    size_entries[-1] = value
+                else:
+                    size_dates.append(entry["effective_from"])
+                    size_entries.append(value)
+            self._dates, self._entries = dates, entries
+            self._expires_at = time.monotonic() + self.ttl
+
+    def invalidate(self):
+        self._expires_at = float("-inf")
+
+    def as_of(self, size: Optional[str], date_str: str) -> Optional[Dict[str, Any]]:
+        """Price entry in force for size on date_str, or None; call ensure_loaded first"""
+        dates = self._dates.get(size)
+        if not dates:
+            return None
+        i = bisect_right(dates, date_str[:10]) - 1
+        return self._entries[size][i] if i >= 0 else None
+
+    async def lookup(self, size: Optional[str], date_str: str) -> Optional[Dict[str, Any]]:
+        await self.ensure_loaded()
+        return self.as_of(size, date_str)
+
+    async def lookup_many(self, lookups: List[Tuple[Optional[str], str]]) -> List[Optional[Dict[str, Any]]]:
+        await self.ensure_loaded()
+        return [self.as_of(size, date_str) for size, date_str in lookups]
+
+price_index = PriceHistoryIndex(PRICE_INDEX_TTL_SECONDS)
+
+def today_str() -> str:
+    # UTC, like every other timestamp the server writes
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+def validate_effective_from(effective_from: Optional[str]) -> str:
+    effective_from = effective_from or today_str()
+    if not _ISO_DATE_RE.match(effective_from):
+        raise HTTPException(status_code=400, detail="Дата має бути у форматі YYYY-MM-DD")
+    # Future changes would never reach price_catalog, which holds the current price
+    if effective_from > today_str():
+        raise HTTPException(status_code=400, detail="Дата набрання чинності не може бути в майбутньому")
+    return effective_from
+
+def price_history_entry(price: Dict[str, Any], price_id: str, effective_from: str,
+                        deleted: bool = False) -> PriceHistoryEntry:
+    return PriceHistoryEntry(**PriceItemCreate(**price).model_dump(), price_id=price_id,
+                             effective_from=effective_from, deleted=deleted)
+
+async def record_price_history(entries: List[PriceHistoryEntry]):
+    await db.price_history.insert_many([entry.model_dump() for entry in entries])
+    price_index.invalidate()
+
+async def backfill_price_history():
+    """Give catalog prices without history an entry effective since PRICE_HISTORY_EPOCH"""
+    known = set(await db.price_history.distinct("price_id"))
+    entries = [
+        price_history_entry(price, price["id"], PRICE_HISTORY_EPOCH)
+        async for price in db.price_catalog.find({}, {"_id": 0}) if price["id"] not in known
+    ]
+    if entries:
+        await record_price_history(entries)
+
 @api_router.get("/prices", response_model=List[PriceItem])
 async def get_prices():
     prices = await db.price_catalog.find({}, {"_id": 0}).to_list(100)
     return prices
 
 @api_router.post("/prices", response_model=PriceItem)
-async def create_price(data: PriceItemCreate):
+async def create_price(data: PriceItemCreate, effective_from: Optional[str] = None):
+    effective_from = validate_effective_from(effective_from)
     price_obj = PriceItem(**data.model_dump())
     doc = price_obj.model_dump()
     await db.price_catalog.insert_one(doc)
+    await record_price_history([price_history_entry(doc, price_obj.id, effective_from)])
     return price_obj
 
 @api_router.put("/prices/{price_id}", response_model=PriceItem)
-async def update_price(price_id: str, data: PriceItemCreate):
+async def update_price(price_id: str, data: PriceItemCreate, effective_from: Optional[str] = None):
+    """Record a new price effective from a date (today by default); backdating is allowed"""
+    effective_from = validate_effective_from(effective_from)
+    existing = await db.price_catalog.find_one({"id": price_id}, {"_id": 0})
+    if not existing:
+        raise HTTPException(status_code=404, detail="Ціну не знайдено")
+    
+    entries = [price_history_entry(data.model_dump(), price_id, effective_from)]
+    if data.size != existing["size"]:
+        # The old size stops being priced by this row
+        entries.append(price_history_entry(existing, price_id, effective_from, deleted=True))
+    latest = await db.price_history.find_one(
+        {"price_id": price_id, "deleted": {"$ne": True}}, sort=[("effective_from", -1)]
+    )
+    await record_price_history(entries)
+    
+    # A backdated change older than the current price only rewrites history
+    if latest and effective_from < latest["effective_from"]:
+        return existing
     result = await db.price_catalog.find_one_and_update(
         {"id": price_id},
         {"$set": data.model_dump()},
+        projection={"_id": 0},
         return_document=True
     )
     if not result:
         raise HTTPException(status_code=404, detail="Ціну не знайдено")
-    result.pop("_id", None)
     return result
 
 @api_router.delete("/prices/{price_id}")
 async def delete_price(price_id: str):
-    result = await db.price_catalog.delete_one({"id": price_id})
-    if result.deleted_count == 0:
+    existing = await db.price_catalog.find_one_and_delete({"id": price_id}, projection={"_id": 0})
+    if not existing:
         raise HTTPException(status_code=404, detail="Ціну не знайдено")
+    await record_price_history([price_history_entry(existing, price_id, today_str(), deleted=True)])
     return {"message": "Видалено"}
 
+@api_router.get("/prices/history", response_model=List[PriceHistoryEntry])
+async def get_price_history(size: Optional[str] = None, price_id: Optional[str] = None):
+    query = {}
+    if size:
+        query["size"] = size
+    if price_id:
+        query["price_id"] = price_id
+    cursor = db.price_history.find(query, {"_id": 0}).sort([("size", 1), ("effective_from", 1), ("recorded_at", 1)])
+    return await cursor.to_list(5000)
+
+@api_router.get("/prices/as-of", response_model=PriceHistoryEntry)
+async def get_price_as_of(size: str, date_str: str):
+    """Price of a size in force on a date"""
+    entry = await price_index.lookup(size, date_str)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Ціну на цю дату не знайдено")
+    return entry
+
+@api_router.post("/prices/as-of")
+async def get_prices_as_of(data: PriceLookupBatch):
+    """Many as-of lookups in one call; results follow the request order, null where unpriced"""
+    entries = await price_index.lookup_many([(lookup.size, lookup.date_str) for lookup in data.lookups])
+    return {"results": [PriceHistoryEntry(**entry) if entry else None for entry in entries]}
+
+def reprice_item(item: Dict[str, Any], price: Dict[str, Any], include_sell_prices: bool) -> OrderItem:
+    """Item with unit costs (and optionally prices) taken from a price entry"""
+    frame = {"1-10": "frame_1_10", "11-14": "frame_11_14"}.get(item.get("frame_type"))
+    fields = {
+        "unit_cost": price["cost_price"],
+        "lacquer_cost": price["lacquer_cost"] if item.get("with_lacquer") else 0,
+        "packaging_cost": price["packaging_cost"] if item.get("with_packaging") else 0,
+        "frame_cost": price[f"{frame}_cost"] if frame else 0,
+    }
+    if include_sell_prices:
+        fields.update({
+            "unit_price": price["sell_price"],
+            "lacquer_price": price["lacquer_price"] if item.get("with_lacquer") else 0,
+            "packaging_price": price["packaging_price"] if item.get("with_packaging") else 0,
+            "frame_price": price[f"{frame}_price"] if frame else 0,
+        })
+    return OrderItem(**{**item, **fields})
+
+# Stored fields reprice_orders reads; its update only applies if they are unchanged
+REPRICE_INPUT_FIELDS = ("_v", "order_date", "items", "total_amount", "total_cost", "discounted_amount",
+                        "extra_income")
+
+def repriced_fields(doc: Dict[str, Any], fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Update setting recomputed order fields, in the stored shape of doc"""
+    if doc.get("_v") != ORDER_SCHEMA_VERSION:
+        return {"$set": fields}
+    compact = compact_order(fields)
+    update = {"$set": {k: compact[k] for k in fields if k in compact}}
+    # compact_order omits fields equal to their default
+    unset = {k: "" for k in fields if k not in compact}
+    if unset:
+        update["$unset"] = unset
+    return update
+
+@api_router.post("/prices/reprice")
+async def reprice_orders(
+    month: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    include_sell_prices: bool = False,
+    apply: bool = False
+):
+    """Recompute hot orders' costs (and optionally prices) from the prices in effect on each order date.
+
+    Dry run by default: reports the margin impact without writing. Archived
+    orders keep their frozen figures and are not repriced.
+    """
+    scope = normalize_order_scope(month, start_date, end_date)
+    query = analytics_match(scope, include_cancelled=True)
+    await price_index.ensure_loaded()
+    
+    totals = {f"{k}_{when}": 0 for k in ("revenue", "cost", "net_income") for when in ("before", "after")}
+    scanned, unpriced, updates, changed_orders = 0, 0, [], []
+    async for doc in db.orders.find(query, {"_id": 0}):
+        order = inflate_order(doc)
+        scanned += 1
+        items = []
+        for item in order.get("items", []):
+            # Catalog products aren't size-priced and keep their figures
+            if item.get("product_id") or not item.get("size"):
+                items.append(OrderItem(**item))
+                continue
+            price = price_index.as_of(item["size"], order["order_date"])
+            if price is None:
+                unpriced += 1
+                items.append(OrderItem(**item))
+            else:
+                items.append(reprice_item(item, price, include_sell_prices))
+        total_amount, total_cost, profit = calculate_order_totals(items)
+        discounted_amount = order.get("discounted_amount")
+        final_amount = discounted_amount if discounted_amount else total_amount
+        net_income = final_amount + (order.get("extra_income") or 0) - total_cost
+        
+        totals["revenue_before"] += order.get("total_amount", 0)
+        totals["cost_before"] += order.get("total_cost", 0)
+        totals["net_income_before"] += order.get("net_income", order.get("profit", 0))
+        totals["revenue_after"] += total_amount
+        totals["cost_after"] += total_cost
+        totals["net_income_after"] += net_income
+        
+        # Compared in kopecks: inflated compact figures carry float noise
+        if (to_kopecks(total_amount), to_kopecks(total_cost)) == (
+                to_kopecks(order.get("total_amount")), to_kopecks(order.get("total_cost"))):
+            continue
+        changed_orders.append(order)
+        updates.append(UpdateOne(
+            # Matches only if nothing this computation read has changed since;
+            # orders edited meanwhile are skipped rather than overwritten
+            {"id": order["id"], **{k: doc.get(k) for k in REPRICE_INPUT_FIELDS}},
+            repriced_fields(doc, {
+                "items": [item.model_dump() for item in items],
+                "total_amount": total_amount,
+                "total_cost": total_cost,
+                "profit": profit,
+                "discount": total_amount - discounted_amount if discounted_amount else 0,
+                "net_income": net_income,
+            })
+        ))
+    
+    skipped = 0
+    if apply and updates:
+        for i in range(0, len(updates), ARCHIVE_BATCH_SIZE):
+            batch = updates[i:i + ARCHIVE_BATCH_SIZE]
+            result = await db.orders.bulk_write(batch, ordered=False)
+            skipped += len(batch) - result.matched_count
+        invalidate_order_caches(*changed_orders)
+    
+    return {
+        "applied": apply,
+        "orders_scanned": scanned,
+        "orders_changed": len(updates) - skipped,
+        "orders_skipped": skipped,
+        "unpriced_items": unpriced,
+        **{k: round(v, 2) for k, v in totals.items()},
+    }
+
 @api_router.post("/prices/seed")
 async def seed_prices():
     """Seed initial price catalog"""
@@ -203,9 +893,11 @@ async def seed_prices():
         {"size": "100х150", "cost_price": 1785, "sell_price": 3240, "lacquer_cost": 185, "lacquer_price": 340, "packaging_cost": 265, "packaging_price": 390, "frame_1_10_cost": 900, "frame_1_10_price": 1800, "frame_11_14_cost": 650, "frame_11_14_price": 1300},
     ]
     
-    for data in prices_data:
-        price_obj = PriceItem(**data)
-        await db.price_catalog.insert_one(price_obj.model_dump())
+    price_objs = [PriceItem(**data) for data in prices_data]
+    await db.price_catalog.insert_many([price_obj.model_dump() for price_obj in price_objs])
+    await record_price_history([
+        price_history_entry(price_obj.model_dump(), price_obj.id, PRICE_HISTORY_EPOCH) for price_obj in price_objs
+    ])
     
     return {"message": "Каталог цін заповнено", "count": len(prices_data)}
 
@@ -242,6 +934,407 @@ async def delete_product(product_id: str):
         raise HTTPException(status_code=404, detail="Товар не знайдено")
     return {"message": "Видалено"}
 
+# ========== ORDER STORAGE ==========
+
+# Orders are stored compactly (schema version 2, marked by `_v`):
+# - money fields are integer kopecks;
+# - order_date/created_at are BSON dates; an order_date that was a UTC
+#   timestamp rather than a plain date is flagged with `_ts`;
+# - fields equal to their default are omitted, and `month` is only kept when
+#   it differs from the month of order_date.
+# inflate_order turns either shape back into the API one; legacy documents
+# (no `_v`) are still read and matched until migrate_orders has rewritten them.
+
+ORDER_SCHEMA_VERSION = 2
+MONTHS_UA = ["Січень", "Лютий", "Березень", "Квітень", "Травень", "Червень",
+             "Липень", "Серпень", "Вересень", "Жовтень", "Листопад", "Грудень"]
+ORDER_MONEY_FIELDS = ("total_amount", "total_cost", "profit", "extra_income", "discounted_amount", "discount",
+                      "net_income")
+ITEM_MONEY_FIELDS = ("unit_price", "unit_cost", "lacquer_price", "lacquer_cost", "packaging_price", "packaging_cost",
+                     "frame_price", "frame_cost", "total_price", "total_cost", "profit")
+ORDER_DEFAULTS = {"comment": None, "extra_income": 0, "discounted_amount": None, "discount": 0, "net_income": 0}
+ITEM_DEFAULTS = {"size": None, "product_id": None, "product_name": None, "quantity": 1, "with_lacquer": False,
+                 "with_packaging": False, "frame_type": None, **{k: 0 for k in ITEM_MONEY_FIELDS}}
+_ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+# Date.toISOString(), the form the UI sends
+_ISO_TIMESTAMP_RE = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}Z$")
+
+def to_kopecks(value: Optional[float]) -> Optional[int]:
+    return None if value is None else int(round(value * 100))
+
+def from_kopecks(value: Optional[int]) -> Optional[float]:
+    return None if value is None else value / 100
+
+def format_order_date(value: datetime, has_time: bool) -> str:
+    """String form of a stored order_date; fixed width, so it sorts like the dates do"""
+    if has_time:
+        return value.isoformat(timespec="milliseconds") + "Z"
+    return value.date().isoformat()
+
+def parse_order_date(value: str) -> Optional[Tuple[datetime, bool]]:
+    """BSON date for an order_date and whether it has a time part.
+
+    Plain YYYY-MM-DD dates and UTC timestamps in the UI's toISOString() form
+    convert; other strings are stored as-is, since they wouldn't format back
+    to the same string.
+    """
+    if not isinstance(value, str):
+        return None
+    for has_time, pattern in ((False, _ISO_DATE_RE), (True, _ISO_TIMESTAMP_RE)):
+        if pattern.match(value):
+            try:
+                parsed = datetime.fromisoformat(value[:-1] if has_time else value)
+            except ValueError:
+                return None
+            return (parsed, has_time) if format_order_date(parsed, has_time) == value else None
+    return None
+
+@lru_cache(maxsize=1024)
+def order_date_threshold(bound: str, has_time: bool) -> datetime:
+    """Earliest stored order_date whose string form sorts at or after `bound`.
+
+    Lets string comparisons on legacy order dates be matched exactly on BSON
+    dates: s >= start becomes date >= threshold(start), s <= end becomes
+    date < threshold(end + "\\0"). Binary search over days or milliseconds,
+    so any bound works, including the "\\uffff" day suffix.
+    """
+    step = timedelta(milliseconds=1) if has_time else timedelta(days=1)
+    low, high = 0, (datetime.max - datetime.min) // step + 1
+    while low < high:
+        middle = (low + high) // 2
+        if format_order_date(datetime.min + middle * step, has_time) >= bound:
+            high = middle
+        else:
+            low = middle + 1
+    # Past every representable date: nothing sorts at or after the bound
+    return datetime.min + low * step if low * step <= datetime.max - datetime.min else datetime.max
+
+def month_bounds(month: str) -> Optional[Tuple[datetime, datetime]]:
+    """[first day, first day of next month) for a label like "Січень 2026" """
+    name, _, year = month.partition(" ")
+    if name not in MONTHS_UA or not year.isdigit():
+        return None
+    start = datetime(int(year), MONTHS_UA.index(name) + 1, 1)
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+def compact_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    doc = {}
+    for key, value in item.items():
+        if key in ITEM_DEFAULTS and value == ITEM_DEFAULTS[key]:
+            continue
+        doc[key] = to_kopecks(value) if key in ITEM_MONEY_FIELDS else value
+    return doc
+
+def compact_order(order: Dict[str, Any]) -> Dict[str, Any]:
+    """Storage form of an order in the API shape; internal fields (search_*) pass through"""
+    doc = {}
+    for key, value in order.items():
+        if key == "_id" or key in ORDER_DEFAULTS and value == ORDER_DEFAULTS[key]:
+            continue
+        if key in ORDER_MONEY_FIELDS:
+            value = to_kopecks(value)
+        elif key == "items":
+            value = [compact_item(item if isinstance(item, dict) else item.model_dump()) for item in value]
+        doc[key] = value
+    
+    parsed = parse_order_date(order.get("order_date"))
+    if parsed is not None:
+        doc["order_date"], has_time = parsed
+        if has_time:
+            doc["_ts"] = True
+        if order.get("month") == extract_month(order["order_date"]):
+            doc.pop("month", None)
+    created_at = order.get("created_at")
+    if isinstance(created_at, str):
+        try:
+            parsed = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+        except ValueError:
+            parsed = None
+        # Naive timestamps are left alone rather than guessed to be UTC
+        if parsed is not None and parsed.tzinfo is not None:
+            # BSON dates hold milliseconds; truncate here so compact_order's
+            # output inflates to what later reads return
+            doc["created_at"] = parsed.astimezone(timezone.utc).replace(microsecond=parsed.microsecond // 1000 * 1000)
+    doc["_v"] = ORDER_SCHEMA_VERSION
+    return doc
+
+def inflate_item(doc: Dict[str, Any]) -> Dict[str, Any]:
+    item = {**ITEM_DEFAULTS, **doc}
+    for key in ITEM_MONEY_FIELDS:
+        if key in doc:
+            item[key] = from_kopecks(doc[key])
+    return item
+
+def inflate_order(doc: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """API shape of a stored order; works on projections and on legacy documents"""
+    if doc is None or doc.get("_v") != ORDER_SCHEMA_VERSION:
+        return doc
+    order = {**ORDER_DEFAULTS, **doc}
+    del order["_v"]
+    order.pop("_ts", None)
+    for key in ORDER_MONEY_FIELDS:
+        if doc.get(key) is not None:
+            order[key] = from_kopecks(doc[key])
+    if isinstance(order.get("order_date"), datetime):
+        order["order_date"] = stored_order_date(doc)
+        if "month" not in doc:
+            order["month"] = extract_month(order["order_date"])
+    if isinstance(order.get("created_at"), datetime):
+        order["created_at"] = order["created_at"].replace(tzinfo=timezone.utc).isoformat()
+    if "items" in order:
+        order["items"] = [inflate_item(item) for item in order["items"]]
+    return order
+
+def stored_order_date(doc: Dict[str, Any]) -> Optional[str]:
+    order_date = doc.get("order_date")
+    return format_order_date(order_date, bool(doc.get("_ts"))) if isinstance(order_date, datetime) else order_date
+
+def stored_date_shape(has_time: bool) -> Dict[str, Any]:
+    return {"_ts": True} if has_time else {"_ts": {"$exists": False}}
+
+def order_date_filter(start: str, end: str) -> Dict[str, Any]:
+    """order_date within the inclusive string bounds [start, end], for every stored shape"""
+    clauses = [{"order_date": {"$gte": start, "$lte": end}}]
+    for has_time in (False, True):
+        low, high = order_date_threshold(start, has_time), order_date_threshold(end + "\0", has_time)
+        if low < high:
+            clauses.append({"order_date": {"$gte": low, "$lt": high}, **stored_date_shape(has_time)})
+    return {"$or": clauses}
+
+def order_date_before(cutoff: str) -> Dict[str, Any]:
+    """order_date sorting before the string `cutoff`, for every stored shape"""
+    return {"$or": [{"order_date": {"$lt": cutoff}}] + [
+        {"order_date": {"$lt": order_date_threshold(cutoff, has_time)}, **stored_date_shape(has_time)}
+        for has_time in (False, True)
+    ]}
+
+def month_filter(month: str) -> Dict[str, Any]:
+    """Orders of a month label, whether stored with `month` or derived from order_date"""
+    bounds = month_bounds(month)
+    if bounds is None:
+        return {"month": month}
+    return {"$or": [
+        {"month": month},
+        {"month": {"$exists": False}, "order_date": {"$gte": bounds[0], "$lt": bounds[1]}},
+    ]}
+
+# Aggregation expressions over both stored shapes. $cond only evaluates the
+# branch it takes, so date operators never see legacy string dates.
+ORDER_DATE_IS_DATE = {"$eq": [{"$type": "$order_date"}, "date"]}
+ORDER_DATE_HAS_TIME = {"$eq": [{"$ifNull": ["$_ts", False]}, True]}
+IS_COMPACT = {"$eq": ["$_v", ORDER_SCHEMA_VERSION]}
+MONTH_EXPR = {"$cond": [{"$ne": [{"$type": "$month"}, "missing"]}, "$month", {"$concat": [
+    {"$arrayElemAt": [MONTHS_UA, {"$subtract": [{"$month": "$order_date"}, 1]}]},
+    " ", {"$toString": {"$year": "$order_date"}},
+]}]}
+DAY_EXPR = {"$cond": [ORDER_DATE_IS_DATE, {"$dateToString": {"format": "%Y-%m-%d", "date": "$order_date"}},
+                      {"$substrCP": ["$order_date", 0, 10]}]}
+WEEK_EXPR = {"$dateToString": {"format": "%G-W%V", "date": {"$cond": [ORDER_DATE_IS_DATE, "$order_date", {
+    "$dateFromString": {"dateString": {"$substrCP": ["$order_date", 0, 10]}, "onError": None, "onNull": None}
+}]}}}
+
+def kopecks_expr(path: str, legacy_default: Any = 0) -> Dict[str, Any]:
+    """Money field in kopecks; sums stay exact and are divided by 100 once at the end"""
+    return {"$cond": [IS_COMPACT, {"$ifNull": [path, 0]}, {"$multiply": [{"$ifNull": [path, legacy_default]}, 100]}]}
+
+def date_range_expr(start: str, end: str) -> Dict[str, Any]:
+    """order_date_filter as an aggregation expression"""
+    string_range = {"$and": [{"$gte": ["$order_date", start]}, {"$lte": ["$order_date", end]}]}
+    date_ranges = [{"$and": [
+        {"$gte": ["$order_date", order_date_threshold(start, has_time)]},
+        {"$lt": ["$order_date", order_date_threshold(end + "\0", has_time)]},
+    ]} for has_time in (False, True)]
+    return {"$cond": [ORDER_DATE_IS_DATE, {"$cond": [ORDER_DATE_HAS_TIME, date_ranges[1], date_ranges[0]]}, string_range]}
+
+# ========== QUERY CACHE ==========
+
+# Normalized (month, start_date, end_date) filter, exactly one form is set:
+# (month, None, None), (None, start, end) or (None, None, None) for everything
+OrderScope = Tuple[Optional[str], Optional[str], Optional[str]]
+
+QUERY_CACHES: List["QueryCache"] = []
+
+def normalize_order_scope(month: Optional[str] = None, start_date: Optional[str] = None,
+                          end_date: Optional[str] = None) -> OrderScope:
+    """Mirror the precedence the analytics queries use: month wins over a date range"""
+    if month:
+        return (month, None, None)
+    if start_date and end_date:
+        return (None, start_date, end_date)
+    return (None, None, None)
+
+def scope_affected(scope: OrderScope, months: set, dates: set) -> bool:
+    month, start_date, end_date = scope
+    if month:
+        return month in months
+    if start_date:
+        # Same string comparison as the {"$gte", "$lte"} order_date query
+        return any(start_date <= d <= end_date for d in dates)
+    return True
+
+class QueryCache:
+    """In-process TTL/LRU cache with single-flight computation.
+
+    Entries remember the order scope they were computed for, so order writes
+    only drop results for the months and dates they touch.
+    """
+
+    def __init__(self, name: str, ttl: float, max_entries: int, settle: float = 0):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.settle = settle
+        self._last_invalidation = float("-inf")
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._inflight: Dict[tuple, Tuple[asyncio.Future, OrderScope]] = {}
+        self._generation = 0
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "invalidations": 0}
+        QUERY_CACHES.append(self)
+
+    async def get_or_compute(self, key: tuple, scope: OrderScope, compute):
+        loop = asyncio.get_running_loop()
+        entry = self._entries.get(key)
+        if entry and entry[0] > loop.time():
+            self._entries.move_to_end(key)
+            self._count("hits", "hit")
+            return entry[2]
+
+        inflight = self._inflight.get(key)
+        if inflight:
+            self._count("coalesced", "coalesced")
+            try:
+                return await asyncio.shield(inflight[0])
+            except asyncio.CancelledError:
+                if not inflight[0].cancelled():
+                    raise
+                # The leader was cancelled, not us: compute it ourselves
+                return await self.get_or_compute(key, scope, compute)
+
+        self._count("misses", "miss")
+        future = loop.create_future()
+        self._inflight[key] = (future, scope)
+        generation = self._generation
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Waiters re-raise it; mark retrieved so an unawaited future doesn't log
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            # Don't store a result an order write may have made stale mid-computation
+            # or that may have been read from a lagging secondary
+            if generation == self._generation and loop.time() - self._last_invalidation >= self.settle:
+                self._entries[key] = (loop.time() + self.ttl, scope, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return value
+        finally:
+            if self._inflight.get(key, (None,))[0] is future:
+                del self._inflight[key]
+
+    def _count(self, stat: str, result: str):
+        self.stats[stat] += 1
+        CACHE_REQUESTS.inc(cache=self.name, result=result)
+
+    def invalidate(self, months: set, dates: set):
+        self._generation += 1
+        self._last_invalidation = asyncio.get_running_loop().time()
+        self.stats["invalidations"] += 1
+        for key in [k for k, e in self._entries.items() if scope_affected(e[1], months, dates)]:
+            del self._entries[key]
+        # New requests must not join computations that started before the write
+        for key in [k for k, (_, sc) in self._inflight.items() if scope_affected(sc, months, dates)]:
+            del self._inflight[key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["coalesced"] + self.stats["misses"]
+        served = self.stats["hits"] + self.stats["coalesced"]
+        return {
+            "name": self.name,
+            "entries": len(self._entries),
+            "in_flight": len(self._inflight),
+            **self.stats,
+            "hit_ratio": round(served / lookups, 4) if lookups else 0
+        }
+
+def invalidate_order_caches(*orders: Optional[Dict[str, Any]]):
+    """Drop cached results that may include any of the given order documents"""
+    months = {o.get("month") for o in orders if o and o.get("month")}
+    dates = {o.get("order_date") for o in orders if o and o.get("order_date")}
+    for cache in QUERY_CACHES:
+        cache.invalidate(months, dates)
+
+analytics_summary_cache = QueryCache(
+    "analytics_summary", ANALYTICS_CACHE_TTL_SECONDS, ANALYTICS_CACHE_MAX_ENTRIES, ANALYTICS_CACHE_SETTLE_SECONDS
+)
+
+# ========== ORDER SEARCH ==========
+
+# Internal search fields are stored on order documents but never returned
+ORDER_PROJECTION = {"_id": 0, "search_name": 0, "search_comment": 0, "search_prefixes": 0}
+
+# Apostrophe variants people type in words like "кав'ярня"
+_APOSTROPHES = dict.fromkeys(map(ord, "'`’ʼ‘′ʹ"), None)
+_SEARCH_FOLD = str.maketrans({"ґ": "г", "ё": "е"})
+_NON_WORD = re.compile(r"[^\w]+")
+
+def normalize_search_text(text: Optional[str]) -> str:
+    """Ukrainian-aware normalization shared by indexing and queries.
+
+    Case-folds, strips stress marks and apostrophes (so кав’ярня, кав'ярня and
+    кавярня match) and folds ґ→г, ё→е, which are often typed interchangeably.
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFC", text).casefold()
+    text = text.replace("\u0301", "").translate(_APOSTROPHES).translate(_SEARCH_FOLD)
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+def search_fields(order: Dict[str, Any]) -> Dict[str, Any]:
+    name = normalize_search_text(order.get("painting_name"))
+    comment = normalize_search_text(order.get("comment"))
+    prefixes = set()
+    for token in f"{name} {comment}".split():
+        for n in range(SEARCH_PREFIX_MIN, min(len(token), SEARCH_PREFIX_MAX) + 1):
+            prefixes.add(token[:n])
+    return {"search_name": name, "search_comment": comment, "search_prefixes": sorted(prefixes)}
+
+async def ensure_order_search_indexes(collection):
+    # Mongo has no Ukrainian stemmer, so the text index sees our normalized tokens as-is
+    await collection.create_index(
+        [("search_name", "text"), ("search_comment", "text")],
+        weights={"search_name": 3, "search_comment": 1},
+        default_language="none",
+        name="order_search_text"
+    )
+    await collection.create_index([("search_prefixes", 1), ("order_date", -1)], name="order_search_prefixes")
+
+async def backfill_search_fields(collection, batch_size: int = 1000):
+    """Add search fields to orders stored before search existed"""
+    batch = []
+    async for order in collection.find({"search_prefixes": {"$exists": False}}, {"id": 1, "painting_name": 1, "comment": 1}):
+        batch.append(UpdateOne({"_id": order["_id"]}, {"$set": search_fields(order)}))
+        if len(batch) >= batch_size:
+            await collection.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await collection.bulk_write(batch, ordered=False)
+
+async def backfill_all_search_fields():
+    try:
+        await backfill_search_fields(db.orders)
+        async for partition in db.order_archive_partitions.find({}, {"collection": 1}):
+            await backfill_search_fields(db[partition["collection"]])
+    except Exception as e:
+        logger.error(f"Error backfilling order search fields: {e}")
+
 # ========== ORDERS ==========
 
 def calculate_order_totals(items: List[OrderItem]) -> tuple:
@@ -273,9 +1366,7 @@ def calculate_order_totals(items: List[OrderItem]) -> tuple:
 def extract_month(order_date: str) -> str:
     try:
         dt = datetime.fromisoformat(order_date.replace('Z', '+00:00'))
-        months_ua = ["Січень", "Лютий", "Березень", "Квітень", "Травень", "Червень",
-                     "Липень", "Серпень", "Вересень", "Жовтень", "Листопад", "Грудень"]
-        return f"{months_ua[dt.month - 1]} {dt.year}"
+        return f"{MONTHS_UA[dt.month - 1]} {dt.year}"
     except:
         return ""
 
@@ -287,9 +1378,13 @@ async def get_orders(
     status: Optional[str] = None,
     sales_channel: Optional[str] = None
 ):
-    query = {}
-    if month:
-        query["month"] = month
+    query = build_orders_filter(month, order_type, size, status, sales_channel)
+    orders = await find_orders(query, normalize_order_scope(month))
+    return orders
+
+def build_orders_filter(month: Optional[str] = None, order_type: Optional[str] = None, size: Optional[str] = None,
+                        status: Optional[str] = None, sales_channel: Optional[str] = None) -> Dict[str, Any]:
+    query = month_filter(month) if month else {}
     if order_type:
         query["order_type"] = order_type
     if status:
@@ -298,19 +1393,85 @@ async def get_orders(
         query["sales_channel"] = sales_channel
     if size:
         query["items.size"] = size
-    
-    orders = await db.orders.find(query, {"_id": 0}).sort("order_date", -1).to_list(1000)
-    return orders
+    return query
+
+class OrderSearchHit(Order):
+    score: Optional[float] = None
+
+class OrderSearchResult(BaseModel):
+    items: List[OrderSearchHit]
+    total: int
+    page: int
+    page_size: int
+
+@api_router.get("/orders/search", response_model=OrderSearchResult)
+async def search_orders(
+    q: str = Query(..., min_length=1),
+    mode: str = Query("text", pattern="^(text|prefix)$"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    month: Optional[str] = None,
+    order_type: Optional[str] = None,
+    size: Optional[str] = None,
+    status: Optional[str] = None,
+    sales_channel: Optional[str] = None
+):
+    """Search orders by painting name and comment.
+
+    `text` ranks whole-word matches by relevance (name weighs more than comment);
+    `prefix` is for autocomplete: every typed word must be a word prefix, newest first.
+    """
+    query = build_orders_filter(month, order_type, size, status, sales_channel)
+    normalized = normalize_search_text(q)
+    projection = dict(ORDER_PROJECTION)
+    if mode == "text":
+        if not normalized:
+            return {"items": [], "total": 0, "page": page, "page_size": page_size}
+        query["$text"] = {"$search": normalized}
+        projection["score"] = {"$meta": "textScore"}
+        sort = [("score", {"$meta": "textScore"}), ("order_date", -1)]
+    else:
+        tokens = [t[:SEARCH_PREFIX_MAX] for t in normalized.split() if len(t) >= SEARCH_PREFIX_MIN]
+        if not tokens:
+            return {"items": [], "total": 0, "page": page, "page_size": page_size}
+        query["search_prefixes"] = {"$all": tokens}
+        sort = [("order_date", -1)]
+    
+    # Text scores don't depend on collection statistics, so hits from the hot
+    # collection and archive partitions can be merged by score
+    collections = [db.orders] + [db[p["collection"]] for p in await archive_partitions(normalize_order_scope(month))]
+    window = page * page_size
+    
+    async def search_collection(collection):
+        hits = await collection.find(query, projection).sort(sort).limit(window).to_list(window)
+        return hits, await collection.count_documents(query)
+    
+    results = await asyncio.gather(*[search_collection(c) for c in collections])
+    hits = [inflate_order(hit) for collection_hits, _ in results for hit in collection_hits]
+    hits.sort(key=lambda o: o.get("order_date", ""), reverse=True)
+    if mode == "text":
+        hits.sort(key=lambda o: o.get("score", 0), reverse=True)
+    return {
+        "items": hits[window - page_size:window],
+        "total": sum(total for _, total in results),
+        "page": page,
+        "page_size": page_size
+    }
 
 @api_router.get("/orders/{order_id}", response_model=Order)
 async def get_order(order_id: str):
-    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    order = inflate_order(await db.orders.find_one({"id": order_id}, ORDER_PROJECTION))
+    if not order:
+        order = await find_archived_order(order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Замовлення не знайдено")
     return order
 
 @api_router.post("/orders", response_model=Order)
-async def create_order(data: OrderCreate):
+async def create_order(data: OrderCreate, idempotency_key: Optional[str] = Header(None)):
+    return await run_idempotent("orders", idempotency_key, data, lambda: insert_order(data))
+
+async def insert_order(data: OrderCreate) -> Order:
     order_dict = data.model_dump()
     
     # Calculate totals
@@ -352,14 +1513,87 @@ async def create_order(data: OrderCreate):
     order_obj = Order(**order_dict)
     
     doc = order_obj.model_dump()
-    await db.orders.insert_one(doc)
-    return order_obj
+    stored = compact_order(doc)
+    await db.orders.insert_one({**stored, **search_fields(doc)})
+    invalidate_order_caches(doc)
+    # As later reads will return it: created_at in milliseconds, money via kopecks
+    return Order(**inflate_order(stored))
+
+@api_router.patch("/orders/bulk-status")
+async def bulk_update_status(data: BulkStatusUpdate):
+    """Set one status on many orders, selected by id list or filter.
+
+    Each collection gets a single update_many; caches are invalidated and
+    touched archive partitions refrozen once for the whole batch.
+    """
+    target = data.status.strip()
+    if not target:
+        raise HTTPException(status_code=400, detail="Статус не може бути порожнім")
+    if data.ids is not None:
+        if not data.ids:
+            raise HTTPException(status_code=400, detail="Список замовлень порожній")
+        selection = {"id": {"$in": data.ids}}
+        scope = (None, None, None)
+    elif data.filter and any(data.filter.model_dump().values()):
+        f = data.filter
+        selection = build_orders_filter(f.month, f.order_type, f.size, f.status, f.sales_channel)
+        if f.order_date:
+            selection = {"$and": [selection, order_date_filter(f.order_date, f.order_date + "\uffff")]}
+        scope = normalize_order_scope(f.month, f.order_date, f.order_date and f.order_date + "\uffff")
+    else:
+        # An empty filter would match every order
+        raise HTTPException(status_code=400, detail="Потрібен фільтр або список замовлень")
+    query = {"$and": [selection, {"status": {"$ne": target}}]}
+    
+    projection = {"_id": 0, "id": 1, "month": 1, "order_date": 1, "_v": 1, "_ts": 1}
+    hot = [inflate_order(o) for o in await db.orders.find(query, projection).to_list(BULK_STATUS_MAX_ORDERS + 1)]
+    if len(hot) > BULK_STATUS_MAX_ORDERS:
+        raise HTTPException(status_code=400, detail=f"Не більше {BULK_STATUS_MAX_ORDERS} замовлень за раз")
+    updated = 0
+    if hot:
+        result = await db.orders.update_many(
+            {"id": {"$in": [o["id"] for o in hot]}, "status": {"$ne": target}}, {"$set": {"status": target}}
+        )
+        updated = result.modified_count
+    
+    if data.ids is not None:
+        entries = await db.order_archive_index.find({"_id": {"$in": data.ids}}).to_list(None)
+        partition_ids = {entry["partition"] for entry in entries}
+    else:
+        partition_ids = {partition["_id"] for partition in await archive_partitions(scope)}
+    archived_orders = []
+    for partition_id in sorted(partition_ids):
+        collection = db[archive_collection(partition_id)]
+        archived = await collection.find(query, {"_id": 0}).to_list(None)
+        if not archived:
+            continue
+        # Stored documents are moved as they are; the inflated ones feed cache invalidation
+        archived_ids = [o["id"] for o in archived]
+        if target in ARCHIVE_STATUSES:
+            await collection.update_many({"id": {"$in": archived_ids}}, {"$set": {"status": target}})
+        else:
+            # Only closed orders are archived; reopened ones move back to the hot collection
+            await db.orders.bulk_write(
+                [ReplaceOne({"id": o["id"]}, {**o, "status": target}, upsert=True) for o in archived], ordered=False
+            )
+            await collection.delete_many({"id": {"$in": archived_ids}})
+            await db.order_archive_index.delete_many({"_id": {"$in": archived_ids}})
+        await freeze_partition(partition_id)
+        archived_orders.extend(inflate_order(o) for o in archived)
+    
+    if hot or archived_orders:
+        invalidate_order_caches(*hot, *archived_orders)
+    return {"status": target, "updated": updated + len(archived_orders), "archived_updated": len(archived_orders)}
 
 @api_router.put("/orders/{order_id}", response_model=Order)
 async def update_order(order_id: str, data: OrderUpdate):
     existing = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    if not existing:
+        # Edited archived orders move back to the hot collection
+        existing = await thaw_archived_order(order_id)
     if not existing:
         raise HTTPException(status_code=404, detail="Замовлення не знайдено")
+    existing = inflate_order(existing)
     
     update_data = {k: v for k, v in data.model_dump().items() if v is not None}
     
@@ -400,19 +1634,29 @@ async def update_order(order_id: str, data: OrderUpdate):
     update_data["discount"] = discount
     update_data["net_income"] = net_income
     
-    result = await db.orders.find_one_and_update(
+    if "painting_name" in update_data or "comment" in update_data:
+        update_data.update(search_fields({**merged, **update_data}))
+    
+    # The whole document is rewritten so fields that became default are dropped
+    result = inflate_order(await db.orders.find_one_and_replace(
         {"id": order_id},
-        {"$set": update_data},
+        compact_order({**existing, **update_data}),
+        projection=ORDER_PROJECTION,
         return_document=True
-    )
-    result.pop("_id", None)
+    ))
+    invalidate_order_caches(existing, result)
     return result
 
 @api_router.delete("/orders/{order_id}")
 async def delete_order(order_id: str):
-    result = await db.orders.delete_one({"id": order_id})
-    if result.deleted_count == 0:
+    deleted = inflate_order(await db.orders.find_one_and_delete(
+        {"id": order_id}, {"_id": 0, "month": 1, "order_date": 1, "_v": 1, "_ts": 1}
+    ))
+    if not deleted:
+        deleted = await delete_archived_order(order_id)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Замовлення не знайдено")
+    invalidate_order_caches(deleted)
     return {"message": "Видалено"}
 
 # ========== ANALYTICS ==========
@@ -423,83 +1667,326 @@ async def get_analytics_summary(
     end_date: Optional[str] = None,
     month: Optional[str] = None
 ):
-    query = {"status": {"$ne": "скасовано"}}
-    if month:
-        query["month"] = month
-    elif start_date and end_date:
-        query["order_date"] = {"$gte": start_date, "$lte": end_date}
-    
-    orders = await db.orders.find(query, {"_id": 0}).to_list(1000)
-    
-    total_revenue = sum(o.get("total_amount", 0) for o in orders)
-    total_cost = sum(o.get("total_cost", 0) for o in orders)
-    total_profit = sum(o.get("profit", 0) for o in orders)
-    total_net_income = sum(o.get("net_income", o.get("profit", 0)) for o in orders)
-    total_discount = sum(o.get("discount", 0) for o in orders)
-    total_extra_income = sum(o.get("extra_income", 0) for o in orders)
-    order_count = len(orders)
-    avg_check = total_revenue / order_count if order_count > 0 else 0
+    scope = normalize_order_scope(month, start_date, end_date)
+    return await analytics_summary_cache.get_or_compute(scope, scope, lambda: compute_analytics_summary(scope))
+
+@api_router.get("/analytics/cache")
+async def get_analytics_cache_stats():
+    """Hit/miss statistics of the analytics result caches"""
+    return [cache.snapshot() for cache in QUERY_CACHES]
+
+SUMMARY_TOTALS = ["total_revenue", "total_cost", "total_profit", "total_net_income",
+                  "total_discount", "total_extra_income", "order_count"]
+SUMMARY_BREAKDOWNS = ["revenue_by_size", "profit_by_size", "revenue_by_type", "profit_by_type",
+                      "revenue_by_channel", "revenue_by_month", "profit_by_month"]
+
+def empty_summary() -> Dict[str, Any]:
+    """Additive summary state; partial summaries of disjoint order sets can be merged"""
+    return {**{k: 0 for k in SUMMARY_TOTALS}, **{k: {} for k in SUMMARY_BREAKDOWNS}}
+
+def add_order_to_summary(summary: Dict[str, Any], order: Dict[str, Any]):
+    net_income = order.get("net_income", order.get("profit", 0))
+    summary["total_revenue"] += order.get("total_amount", 0)
+    summary["total_cost"] += order.get("total_cost", 0)
+    summary["total_profit"] += order.get("profit", 0)
+    summary["total_net_income"] += net_income
+    summary["total_discount"] += order.get("discount", 0)
+    summary["total_extra_income"] += order.get("extra_income", 0)
+    summary["order_count"] += 1
     
     # By size
-    revenue_by_size = {}
-    profit_by_size = {}
-    for order in orders:
-        for item in order.get("items", []):
-            size = item.get("size", "Інше")
-            if size:
-                revenue_by_size[size] = revenue_by_size.get(size, 0) + item.get("total_price", 0)
-                profit_by_size[size] = profit_by_size.get(size, 0) + item.get("profit", 0)
+    for item in order.get("items", []):
+        size = item.get("size", "Інше")
+        if size:
+            summary["revenue_by_size"][size] = summary["revenue_by_size"].get(size, 0) + item.get("total_price", 0)
+            summary["profit_by_size"][size] = summary["profit_by_size"].get(size, 0) + item.get("profit", 0)
     
     # By type
-    revenue_by_type = {}
-    profit_by_type = {}
-    for order in orders:
-        otype = order.get("order_type", "Інше")
-        revenue_by_type[otype] = revenue_by_type.get(otype, 0) + order.get("total_amount", 0)
-        profit_by_type[otype] = profit_by_type.get(otype, 0) + order.get("net_income", order.get("profit", 0))
+    otype = order.get("order_type", "Інше")
+    summary["revenue_by_type"][otype] = summary["revenue_by_type"].get(otype, 0) + order.get("total_amount", 0)
+    summary["profit_by_type"][otype] = summary["profit_by_type"].get(otype, 0) + net_income
     
     # By channel
-    revenue_by_channel = {}
-    for order in orders:
-        channel = order.get("sales_channel", "Інше")
-        revenue_by_channel[channel] = revenue_by_channel.get(channel, 0) + order.get("total_amount", 0)
+    channel = order.get("sales_channel", "Інше")
+    summary["revenue_by_channel"][channel] = summary["revenue_by_channel"].get(channel, 0) + order.get("total_amount", 0)
     
     # By month
-    revenue_by_month = {}
-    profit_by_month = {}
-    for order in orders:
-        m = order.get("month", "Невідомо")
-        revenue_by_month[m] = revenue_by_month.get(m, 0) + order.get("total_amount", 0)
-        profit_by_month[m] = profit_by_month.get(m, 0) + order.get("net_income", order.get("profit", 0))
+    m = order.get("month", "Невідомо")
+    summary["revenue_by_month"][m] = summary["revenue_by_month"].get(m, 0) + order.get("total_amount", 0)
+    summary["profit_by_month"][m] = summary["profit_by_month"].get(m, 0) + net_income
+
+def merge_summaries(summary: Dict[str, Any], other: Dict[str, Any]):
+    for key in SUMMARY_TOTALS:
+        summary[key] += other.get(key, 0)
+    for key in SUMMARY_BREAKDOWNS:
+        target = summary[key]
+        for name, value in other.get(key, {}).items():
+            target[name] = target.get(name, 0) + value
+
+def finalize_summary(summary: Dict[str, Any]) -> Dict[str, Any]:
+    order_count = summary["order_count"]
+    avg_check = summary["total_revenue"] / order_count if order_count > 0 else 0
+    result = {k: summary[k] for k in SUMMARY_TOTALS}
+    result["avg_check"] = round(avg_check, 2)
+    result.update({k: summary[k] for k in SUMMARY_BREAKDOWNS})
+    return result
+
+def analytics_match(scope: OrderScope, include_cancelled: bool = False) -> Dict[str, Any]:
+    month, start_date, end_date = scope
+    match = {} if include_cancelled else {"status": {"$ne": "скасовано"}}
+    if month:
+        match.update(month_filter(month))
+    elif start_date:
+        match.update(order_date_filter(start_date, end_date))
+    return match
+
+async def compute_analytics_summary(scope: OrderScope) -> Dict[str, Any]:
+    query = analytics_match(scope)
+    
+    summary = empty_summary()
+    async for order in reporting_db.orders.find(query, ORDER_PROJECTION):
+        add_order_to_summary(summary, inflate_order(order))
+    
+    # Archived months contribute their frozen aggregates instead of a scan
+    for partition in await archive_partitions(scope, reporting_db):
+        frozen = partition_frozen_summaries(partition, scope)
+        if frozen is None:
+            async for order in reporting_db[partition["collection"]].find(query, ORDER_PROJECTION):
+                add_order_to_summary(summary, inflate_order(order))
+        else:
+            for part in frozen:
+                merge_summaries(summary, part)
+    
+    return finalize_summary(summary)
+
+# ----- Pivot -----
+
+ORDER_DIMENSIONS = {
+    "month": MONTH_EXPR,
+    "day": DAY_EXPR,
+    "week": WEEK_EXPR,
+    "order_type": "$order_type",
+    "sales_channel": "$sales_channel",
+    "status": "$status",
+}
+# Compact documents omit default item fields, so missing values are normalized
+ITEM_DIMENSIONS = {
+    "size": {"$ifNull": ["$items.size", None]},
+    "frame_type": {"$ifNull": ["$items.frame_type", None]},
+    "with_lacquer": {"$ifNull": ["$items.with_lacquer", False]},
+    "with_packaging": {"$ifNull": ["$items.with_packaging", False]},
+}
+# metric: (per-order value, per-item value); None where the metric has no item-level meaning
+PIVOT_METRICS = {
+    "revenue": (kopecks_expr("$total_amount"), kopecks_expr("$items.total_price")),
+    "cost": (kopecks_expr("$total_cost"), kopecks_expr("$items.total_cost")),
+    "profit": (kopecks_expr("$profit"), kopecks_expr("$items.profit")),
+    # Same convention as the summary: item-level breakdowns use item profit
+    "net_income": (kopecks_expr("$net_income", "$profit"), kopecks_expr("$items.profit")),
+    "discount": (kopecks_expr("$discount"), None),
+    "extra_income": (kopecks_expr("$extra_income"), None),
+    "quantity": (
+        {"$sum": {"$map": {"input": "$items", "in": {"$ifNull": ["$$this.quantity", 1]}}}},
+        {"$ifNull": ["$items.quantity", 1]}
+    ),
+    "order_count": (None, None),
+    "avg_check": (None, None),
+}
+PIVOT_MONEY_METRICS = {"revenue", "cost", "profit", "net_income", "discount", "extra_income"}
+PIVOT_MAX_DIMENSIONS = 2
+
+analytics_pivot_cache = QueryCache(
+    "analytics_pivot", ANALYTICS_CACHE_TTL_SECONDS, ANALYTICS_CACHE_MAX_ENTRIES, ANALYTICS_CACHE_SETTLE_SECONDS
+)
+
+def split_params(values: List[str]) -> List[str]:
+    """Accept both repeated (?a=x&a=y) and comma-separated (?a=x,y) query params"""
+    return [v.strip() for value in values for v in value.split(",") if v.strip()]
+
+async def orders_pipeline_source(scopes: List[OrderScope], match: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Leading stages reading matching orders from the hot collection and routed archive partitions"""
+    stages = [{"$match": match}]
+    collections = []
+    for scope in scopes:
+        for partition in await archive_partitions(scope, reporting_db):
+            if partition["collection"] not in collections:
+                collections.append(partition["collection"])
+    for collection in collections:
+        stages.append({"$unionWith": {"coll": collection, "pipeline": [{"$match": match}]}})
+    return stages
+
+def compile_pivot_stages(dimensions: List[str], metrics: List[str]) -> List[Dict[str, Any]]:
+    item_level = any(d in ITEM_DIMENSIONS for d in dimensions)
+    group: Dict[str, Any] = {"_id": {d: ORDER_DIMENSIONS.get(d) or ITEM_DIMENSIONS[d] for d in dimensions}}
+    
+    needs_count = "order_count" in metrics or "avg_check" in metrics
+    if needs_count:
+        # Orders are repeated once per item after $unwind, so count distinct ids there
+        group["_orders"] = {"$addToSet": "$id"} if item_level else {"$sum": 1}
+    summed = [m for m in metrics if m not in ("order_count", "avg_check")]
+    if "avg_check" in metrics and "revenue" not in summed:
+        summed.append("revenue")
+    for metric in summed:
+        expr = PIVOT_METRICS[metric][1 if item_level else 0]
+        if expr is None:
+            raise HTTPException(status_code=400, detail=f"Метрика {metric} недоступна для розбивки по товарах")
+        group[metric] = {"$sum": expr}
+    
+    stages = [{"$unwind": "$items"}] if item_level else []
+    stages.append({"$group": group})
+    if needs_count and item_level:
+        stages.append({"$addFields": {"_orders": {"$size": "$_orders"}}})
+    stages.append({"$sort": {f"_id.{d}": 1 for d in dimensions}})
+    return stages
+
+def pivot_row(row: Dict[str, Any], dimensions: List[str], metrics: List[str]) -> Dict[str, Any]:
+    result = {d: row["_id"].get(d) for d in dimensions}
+    for metric in metrics:
+        if metric == "order_count":
+            result[metric] = row["_orders"]
+        elif metric == "avg_check":
+            result[metric] = round(row["revenue"] / 100 / row["_orders"], 2) if row["_orders"] else 0
+        elif metric in PIVOT_MONEY_METRICS:
+            result[metric] = round(row[metric] / 100, 2)
+        else:
+            result[metric] = row[metric]
+    return result
+
+@api_router.get("/analytics/pivot")
+async def get_analytics_pivot(
+    group_by: List[str] = Query(...),
+    metrics: List[str] = Query(["revenue", "net_income", "order_count"]),
+    month: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    include_cancelled: bool = False
+):
+    """Group orders by one or two dimensions and compute only the requested metrics.
+
+    The request is compiled into a single aggregation pipeline; results are
+    cached by the normalized spec.
+    """
+    dimensions = split_params(group_by)
+    metric_names = sorted(set(split_params(metrics)))
+    unknown = [d for d in dimensions if d not in ORDER_DIMENSIONS and d not in ITEM_DIMENSIONS]
+    unknown += [m for m in metric_names if m not in PIVOT_METRICS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Невідомі параметри: {', '.join(unknown)}")
+    if not 1 <= len(dimensions) <= PIVOT_MAX_DIMENSIONS or len(set(dimensions)) != len(dimensions):
+        raise HTTPException(status_code=400, detail=f"Потрібно від 1 до {PIVOT_MAX_DIMENSIONS} різних вимірів")
+    if not metric_names:
+        raise HTTPException(status_code=400, detail="Потрібна хоча б одна метрика")
+    
+    scope = normalize_order_scope(month, start_date, end_date)
+    stages = compile_pivot_stages(dimensions, metric_names)
+    
+    async def compute():
+        match = analytics_match(scope, include_cancelled)
+        pipeline = await orders_pipeline_source([scope], match) + stages
+        rows = await reporting_db.orders.aggregate(pipeline).to_list(None)
+        return {"dimensions": dimensions, "metrics": metric_names,
+                "rows": [pivot_row(row, dimensions, metric_names) for row in rows]}
+    
+    key = (tuple(dimensions), tuple(metric_names), scope, include_cancelled)
+    return await analytics_pivot_cache.get_or_compute(key, scope, compute)
+
+# ----- Period comparison -----
+
+COMPARE_MAX_PERIODS = 12
+# Order-level totals in kopecks, same definitions as add_order_to_summary
+COMPARE_METRICS = {
+    "total_revenue": kopecks_expr("$total_amount"),
+    "total_cost": kopecks_expr("$total_cost"),
+    "total_profit": kopecks_expr("$profit"),
+    "total_net_income": kopecks_expr("$net_income", "$profit"),
+    "total_discount": kopecks_expr("$discount"),
+    "total_extra_income": kopecks_expr("$extra_income"),
+}
+
+analytics_compare_cache = QueryCache(
+    "analytics_compare", ANALYTICS_CACHE_TTL_SECONDS, ANALYTICS_CACHE_MAX_ENTRIES, ANALYTICS_CACHE_SETTLE_SECONDS
+)
+
+def parse_period(value: str) -> OrderScope:
+    """A month label ("Січень 2026") or an inclusive date range ("2026-01-01..2026-01-31")"""
+    value = value.strip()
+    if ".." in value:
+        start_date, end_date = (part.strip() for part in value.split("..", 1))
+        if not (_ISO_DATE_RE.match(start_date) and _ISO_DATE_RE.match(end_date)) or start_date > end_date:
+            raise HTTPException(status_code=400, detail=f"Невірний період: {value}")
+        return (None, start_date, end_date)
+    if not value:
+        raise HTTPException(status_code=400, detail="Період не може бути порожнім")
+    return (value, None, None)
+
+def period_label(scope: OrderScope) -> str:
+    month, start_date, end_date = scope
+    return month or f"{start_date}..{end_date}"
+
+def period_condition(scope: OrderScope) -> Dict[str, Any]:
+    """analytics_match's scope filter as an aggregation expression"""
+    month, start_date, end_date = scope
+    if month:
+        return {"$eq": [MONTH_EXPR, month]}
+    return date_range_expr(start_date, end_date)
+
+def period_totals(row: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    row = row or {}
+    totals = {k: round(row.get(k, 0) / 100, 2) for k in COMPARE_METRICS}
+    totals["order_count"] = order_count = row.get("order_count", 0)
+    totals["avg_check"] = round(totals["total_revenue"] / order_count, 2) if order_count > 0 else 0
+    return totals
+
+async def compute_period_comparison(periods: List[OrderScope]) -> List[Dict[str, Any]]:
+    """Totals for every period from one pass; an order counts towards each period it falls in"""
+    match = {"status": {"$ne": "скасовано"}, "$or": [analytics_match(p, include_cancelled=True) for p in periods]}
+    pipeline = await orders_pipeline_source(periods, match) + [
+        {"$project": {
+            **{k: 1 for k in ("_v", "total_amount", "total_cost", "profit", "net_income", "discount", "extra_income")},
+            "_periods": {"$concatArrays": [
+                {"$cond": [period_condition(p), [i], []]} for i, p in enumerate(periods)
+            ]},
+        }},
+        {"$unwind": "$_periods"},
+        {"$group": {"_id": "$_periods", "order_count": {"$sum": 1}, **{k: {"$sum": v} for k, v in COMPARE_METRICS.items()}}},
+    ]
+    rows = {row["_id"]: row async for row in reporting_db.orders.aggregate(pipeline)}
+    return [period_totals(rows.get(i)) for i in range(len(periods))]
+
+@api_router.get("/analytics/compare")
+async def compare_analytics_periods(base: str, compare: List[str] = Query(...)):
+    """Totals of a base period against comparison periods, with absolute and percentage deltas.
+
+    Periods are month labels or date ranges "YYYY-MM-DD..YYYY-MM-DD"; deltas are
+    base minus comparison, percentages relative to the comparison period.
+    """
+    base_scope = parse_period(base)
+    compare_scopes = [parse_period(p) for p in compare]
+    if len(compare_scopes) > COMPARE_MAX_PERIODS:
+        raise HTTPException(status_code=400, detail=f"Не більше {COMPARE_MAX_PERIODS} періодів для порівняння")
+    periods = [base_scope, *compare_scopes]
+    
+    # Entries span several scopes, so any order write invalidates them
+    totals = await analytics_compare_cache.get_or_compute(
+        tuple(periods), (None, None, None), lambda: compute_period_comparison(periods)
+    )
     
-    return {
-        "total_revenue": total_revenue,
-        "total_cost": total_cost,
-        "total_profit": total_profit,
-        "total_net_income": total_net_income,
-        "total_discount": total_discount,
-        "total_extra_income": total_extra_income,
-        "order_count": order_count,
-        "avg_check": round(avg_check, 2),
-        "revenue_by_size": revenue_by_size,
-        "profit_by_size": profit_by_size,
-        "revenue_by_type": revenue_by_type,
-        "profit_by_type": profit_by_type,
-        "revenue_by_channel": revenue_by_channel,
-        "revenue_by_month": revenue_by_month,
-        "profit_by_month": profit_by_month
-    }
+    base_totals = totals[0]
+    comparisons = []
+    for scope, period in zip(compare_scopes, totals[1:]):
+        delta = {k: round(base_totals[k] - period[k], 2) for k in base_totals}
+        delta_pct = {k: round(delta[k] / period[k] * 100, 2) if period[k] else None for k in base_totals}
+        comparisons.append({"period": period_label(scope), "totals": period, "delta": delta, "delta_pct": delta_pct})
+    return {"base": {"period": period_label(base_scope), "totals": base_totals}, "comparisons": comparisons}
 
 @api_router.get("/analytics/daily")
 async def get_daily_analytics(date_str: Optional[str] = None):
     if not date_str:
         date_str = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     
-    query = {
-        "order_date": {"$regex": f"^{date_str}"},
-        "status": {"$ne": "скасовано"}
-    }
-    orders = await db.orders.find(query, {"_id": 0}).to_list(100)
+    # "\uffff" sorts after any time suffix, so this covers every order_date with the prefix
+    scope = (None, date_str, date_str + "\uffff")
+    orders = await find_orders(analytics_match(scope), scope, limit=100, sort=False)
     
     total_revenue = sum(o.get("total_amount", 0) for o in orders)
     total_net_income = sum(o.get("net_income", o.get("profit", 0)) for o in orders)
@@ -514,8 +2001,16 @@ async def get_daily_analytics(date_str: Optional[str] = None):
 
 @api_router.get("/analytics/months")
 async def get_available_months():
-    orders = await db.orders.find({}, {"month": 1, "_id": 0}).to_list(1000)
-    months = list(set(o.get("month") for o in orders if o.get("month")))
+    # Compact orders only store month when it isn't derived from order_date
+    months = set(await reporting_db.orders.distinct("month"))
+    months.update([row["_id"] async for row in reporting_db.orders.aggregate([
+        {"$match": {"month": {"$exists": False}, "order_date": {"$type": "date"}}},
+        {"$group": {"_id": MONTH_EXPR}},
+    ])])
+    months.discard(None)
+    months.discard("")
+    async for partition in reporting_db.order_archive_partitions.find({}, {"months": 1}):
+        months.update(partition.get("months", []))
     return sorted(months, reverse=True)
 
 # ========== EXPORT ==========
@@ -526,13 +2021,13 @@ async def export_to_excel(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None
 ):
-    query = {}
-    if month:
-        query["month"] = month
-    elif start_date and end_date:
-        query["order_date"] = {"$gte": start_date, "$lte": end_date}
+    scope = normalize_order_scope(month, start_date, end_date)
+    orders = await find_orders(analytics_match(scope, include_cancelled=True), scope, database=reporting_db)
     
-    orders = await db.orders.find(query, {"_id": 0}).sort("order_date", -1).to_list(1000)
+    # Imported on first export: openpyxl is the slowest import of the app
+    import openpyxl
+    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+    from openpyxl.utils import get_column_letter
     
     wb = openpyxl.Workbook()
     ws = wb.active
@@ -577,19 +2072,488 @@ async def export_to_excel(
     
     # Adjust column widths
     for col in range(1, 13):
-        ws.column_dimensions[openpyxl.utils.get_column_letter(col)].width = 15
+        ws.column_dimensions[get_column_letter(col)].width = 15
     
     output = BytesIO()
     wb.save(output)
     output.seek(0)
     
     filename = f"orders_{month or 'all'}.xlsx"
+    # Month names are Cyrillic, headers must be latin-1: use RFC 5987 encoding
     return StreamingResponse(
         output,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        headers={"Content-Disposition": f"attachment; filename=orders.xlsx; filename*=UTF-8''{quote(filename)}"}
     )
 
+# ========== BATCH ==========
+
+class BatchSubRequest(BaseModel):
+    id: Optional[str] = None
+    path: str
+    params: Dict[str, Any] = {}
+
+class BatchRequest(BaseModel):
+    requests: List[BatchSubRequest]
+
+async def dispatch_subrequest(http: "httpx.AsyncClient", sub: BatchSubRequest) -> Dict[str, Any]:
+    if not sub.path.startswith("/api/") or sub.path.startswith(("/api/batch", "/api/export")):
+        return {"id": sub.id, "status": 400, "body": {"detail": "Шлях не підтримується в пакетному запиті"}}
+    response = await http.get(sub.path, params=sub.params)
+    try:
+        body = response.json()
+    except ValueError:
+        body = response.text
+    return {"id": sub.id, "status": response.status_code, "body": body}
+
+@api_router.post("/batch")
+async def batch(data: BatchRequest):
+    """Run several GET sub-requests in-process and return all results at once.
+
+    Each sub-request goes through the full app (routing, validation, caches)
+    and keeps its own status code; one failing doesn't fail the batch.
+    """
+    if len(data.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"Не більше {BATCH_MAX_REQUESTS} запитів у пакеті")
+
+    import httpx
+    
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://batch") as http:
+        responses = await asyncio.gather(*[dispatch_subrequest(http, sub) for sub in data.requests])
+    return {"responses": responses}
+
+# ========== PROFILING ==========
+
+def is_admin_token(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Доступ заборонено")
+
+class StackSampler:
+    """Samples the event loop thread's stack from a background thread.
+
+    Only one request is profiled at a time; since the loop is shared, samples
+    taken while that request awaits may show other requests' frames.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.frames: List[Dict[str, Any]] = []
+        self._frame_index: Dict[tuple, int] = {}
+        self.samples: List[List[int]] = []
+        self.weights: List[float] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._started = self._last = time.perf_counter()
+        self._thread.start()
+
+    def stop(self) -> float:
+        self._stop.set()
+        self._thread.join()
+        return time.perf_counter() - self._started
+
+    def _index(self, code) -> int:
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self._frame_index.get(key)
+        if index is None:
+            index = self._frame_index[key] = len(self.frames)
+            self.frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+        return index
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            stack = []
+            while frame is not None:
+                stack.append(self._index(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append(stack)
+            self.weights.append(now - self._last)
+            self._last = now
+
+    def to_speedscope(self, name: str, duration: float) -> Dict[str, Any]:
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "kuvot-art-api",
+            "shared": {"frames": self.frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": duration,
+                "samples": self.samples,
+                "weights": self.weights
+            }]
+        }
+
+def save_profile(name: str, profile: Dict[str, Any]):
+    """Write a profile and drop the oldest ones beyond PROFILE_MAX_FILES"""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    (PROFILE_DIR / name).write_text(json.dumps(profile), encoding="utf-8")
+    profiles = sorted(PROFILE_DIR.glob("*.speedscope.json"))
+    for old in profiles[:-PROFILE_MAX_FILES]:
+        old.unlink(missing_ok=True)
+
+class ProfilingMiddleware:
+    """Profiles a single request when an admin sends `X-Profile: 1` or `?__profile=1`"""
+
+    def __init__(self, app):
+        self.app = app
+        self._busy = False
+
+    def _wants_profile(self, scope) -> bool:
+        params = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        if params.get("__profile") == ["1"]:
+            return True
+        return any(k == b"x-profile" and v == b"1" for k, v in scope["headers"])
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        token = headers.get(b"x-admin-token", b"").decode("latin-1")
+        if not is_admin_token(token):
+            logger.warning("Ignoring profiling request without a valid admin token")
+            await self.app(scope, receive, send)
+            return
+        if self._busy:
+            await self.app(scope, receive, send)
+            return
+
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        route = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_") or "root"
+        name = f"{stamp}_{scope['method']}_{route}.speedscope.json"
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", name.encode())]
+            await send(message)
+
+        self._busy = True
+        sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_SECONDS)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = sampler.stop()
+            self._busy = False
+            profile = sampler.to_speedscope(f"{scope['method']} {scope['path']}", duration)
+            await asyncio.to_thread(save_profile, name, profile)
+
+@api_router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """List stored request profiles, newest first"""
+    if not PROFILE_DIR.exists():
+        return []
+    profiles = sorted(PROFILE_DIR.glob("*.speedscope.json"), reverse=True)
+    return [
+        {"name": p.name, "size": p.stat().st_size, "created_at": datetime.fromtimestamp(p.stat().st_mtime, timezone.utc).isoformat()}
+        for p in profiles
+    ]
+
+@api_router.get("/admin/profiles/{name}", dependencies=[Depends(require_admin)])
+async def get_profile(name: str):
+    """Download a profile, open it at https://www.speedscope.app"""
+    path = PROFILE_DIR / name
+    if "/" in name or not name.endswith(".speedscope.json") or not path.exists():
+        raise HTTPException(status_code=404, detail="Профіль не знайдено")
+    return FileResponse(path, media_type="application/json", filename=name)
+
+# ========== CONCURRENCY LIMITS ==========
+
+# First matching prefix wins. Batch requests aren't limited themselves: each
+# sub-request passes through the middleware and takes a slot of its own class.
+ROUTE_CLASS_PREFIXES = [
+    ("/api/export/", "export"),
+    ("/api/analytics/", "analytics"),
+    ("/api/nova-poshta/", "nova_poshta"),
+    ("/api/batch", None),
+    ("/api/", "crud"),
+]
+
+def route_class_of(path: str) -> Optional[str]:
+    for prefix, route_class in ROUTE_CLASS_PREFIXES:
+        if path.startswith(prefix):
+            return route_class
+    return None
+
+class ConcurrencyLimiter:
+    """Admits `limit` concurrent requests and queues up to `queue` more, first come first served"""
+
+    def __init__(self, route_class: str, limit: int, queue: int, queue_timeout: float, retry_after: int):
+        self.route_class = route_class
+        self.limit = limit
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(limit)
+
+    async def acquire(self) -> Optional[str]:
+        """Take a slot, waiting in the queue if needed; returns why it was refused, if it was"""
+        # locked() is also true while others queue, so newcomers can't jump ahead
+        if not self._slots.locked():
+            await self._slots.acquire()
+            HTTP_QUEUE_WAIT.observe(0, route_class=self.route_class)
+            return None
+        if self.waiting >= self.queue:
+            return "queue_full"
+
+        start = time.perf_counter()
+        self.waiting += 1
+        HTTP_QUEUE_DEPTH.set(self.waiting, route_class=self.route_class)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+            return None
+        except asyncio.TimeoutError:
+            return "queue_timeout"
+        finally:
+            self.waiting -= 1
+            HTTP_QUEUE_DEPTH.set(self.waiting, route_class=self.route_class)
+            HTTP_QUEUE_WAIT.observe(time.perf_counter() - start, route_class=self.route_class)
+
+    def release(self):
+        self._slots.release()
+
+concurrency_limiters = {
+    name: ConcurrencyLimiter(name, **settings)
+    for name, settings in CONCURRENCY_LIMITS.items() if settings["limit"] > 0
+}
+
+class ConcurrencyLimitMiddleware:
+    """ASGI middleware keeping each route class within its concurrency limit.
+
+    Requests beyond the limit and the queue get an immediate 503 with
+    Retry-After, as do queued requests that waited longer than the class allows.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limiter = concurrency_limiters.get(route_class_of(scope["path"])) if scope["type"] == "http" else None
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        refused = await limiter.acquire()
+        if refused:
+            HTTP_REJECTED.inc(route_class=limiter.route_class, reason=refused)
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Сервер перевантажено, спробуйте пізніше"},
+                headers={"Retry-After": str(limiter.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        HTTP_ROUTE_CLASS_IN_FLIGHT.inc(route_class=limiter.route_class)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            HTTP_ROUTE_CLASS_IN_FLIGHT.dec(route_class=limiter.route_class)
+            limiter.release()
+
+# ========== ARCHIVE ==========
+
+# Orders live in the hot `orders` collection until archival moves closed ones into
+# `orders_archive_YYYY_MM` partitions (by order_date). `order_archive_partitions` holds
+# one catalog document per partition with its date span, month labels and frozen
+# per-month summaries; `order_archive_index` maps archived order ids to partitions.
+
+async def archive_partitions(scope: OrderScope, database=None) -> List[Dict[str, Any]]:
+    """Catalog entries of partitions that may hold orders in scope, newest first"""
+    database = database if database is not None else db
+    month, start_date, end_date = scope
+    query = {}
+    if month:
+        query["months"] = month
+    elif start_date:
+        query = {"first_date": {"$lte": end_date}, "last_date": {"$gte": start_date}}
+    return await database.order_archive_partitions.find(query).sort("last_date", -1).to_list(None)
+
+def partition_frozen_summaries(partition: Dict[str, Any], scope: OrderScope) -> Optional[List[Dict[str, Any]]]:
+    """Frozen summaries answering scope for this partition, or None if it must be scanned"""
+    month, start_date, end_date = scope
+    aggregates = partition.get("aggregates", {})
+    if month:
+        return [aggregates[month]] if month in aggregates else []
+    if start_date and not (start_date <= partition["first_date"] and partition["last_date"] <= end_date):
+        return None
+    return list(aggregates.values())
+
+async def find_orders(query: Dict[str, Any], scope: OrderScope, limit: int = 1000, sort: bool = True,
+                      database=None) -> List[Dict[str, Any]]:
+    """Run an orders query over the hot collection and the archive partitions scope routes to"""
+    database = database if database is not None else db
+    cursor = database.orders.find(query, ORDER_PROJECTION)
+    if sort:
+        cursor = cursor.sort("order_date", -1)
+    orders = [inflate_order(o) for o in await cursor.to_list(limit)]
+    
+    for partition in await archive_partitions(scope, database):
+        if len(orders) >= limit and (not sort or orders[-1].get("order_date", "") >= partition["last_date"]):
+            # Partitions come newest first, older ones can't make the cut either
+            break
+        cursor = database[partition["collection"]].find(query, ORDER_PROJECTION)
+        if sort:
+            cursor = cursor.sort("order_date", -1)
+        orders.extend(inflate_order(o) for o in await cursor.to_list(limit))
+        if sort:
+            orders.sort(key=lambda o: o.get("order_date", ""), reverse=True)
+        del orders[limit:]
+    return orders
+
+async def locate_archived_order(order_id: str) -> Optional[str]:
+    entry = await db.order_archive_index.find_one({"_id": order_id})
+    return entry["partition"] if entry else None
+
+async def find_archived_order(order_id: str) -> Optional[Dict[str, Any]]:
+    partition_id = await locate_archived_order(order_id)
+    if not partition_id:
+        return None
+    return inflate_order(await db[archive_collection(partition_id)].find_one({"id": order_id}, ORDER_PROJECTION))
+
+async def thaw_archived_order(order_id: str) -> Optional[Dict[str, Any]]:
+    """Move an archived order back to the hot collection, e.g. before editing it"""
+    partition_id = await locate_archived_order(order_id)
+    if not partition_id:
+        return None
+    collection = db[archive_collection(partition_id)]
+    order = await collection.find_one({"id": order_id}, {"_id": 0})
+    if order:
+        await db.orders.replace_one({"id": order_id}, order, upsert=True)
+        await collection.delete_one({"id": order_id})
+    await db.order_archive_index.delete_one({"_id": order_id})
+    await freeze_partition(partition_id)
+    return order
+
+async def delete_archived_order(order_id: str) -> Optional[Dict[str, Any]]:
+    partition_id = await locate_archived_order(order_id)
+    if not partition_id:
+        return None
+    order = await db[archive_collection(partition_id)].find_one_and_delete(
+        {"id": order_id}, {"_id": 0, "month": 1, "order_date": 1, "_v": 1, "_ts": 1}
+    )
+    await db.order_archive_index.delete_one({"_id": order_id})
+    await freeze_partition(partition_id)
+    return inflate_order(order)
+
+def archive_partition_id(order_date: str) -> Optional[str]:
+    if not re.match(r"^\d{4}-\d{2}", order_date or ""):
+        return None
+    return order_date[:7].replace("-", "_")
+
+def archive_collection(partition_id: str) -> str:
+    return f"orders_archive_{partition_id}"
+
+async def freeze_partition(partition_id: str):
+    """Recompute a partition's catalog entry and frozen per-month summaries"""
+    collection = archive_collection(partition_id)
+    aggregates: Dict[str, Dict[str, Any]] = {}
+    months = set()
+    first_date, last_date, order_count = None, None, 0
+    async for doc in db[collection].find({}, {"_id": 0}):
+        order = inflate_order(doc)
+        order_count += 1
+        order_date = order.get("order_date", "")
+        first_date = order_date if first_date is None else min(first_date, order_date)
+        last_date = order_date if last_date is None else max(last_date, order_date)
+        month = order.get("month", "Невідомо")
+        months.add(month)
+        summary = aggregates.setdefault(month, empty_summary())
+        # Same filter as the live summary query
+        if order.get("status") != "скасовано":
+            add_order_to_summary(summary, order)
+    
+    if not order_count:
+        await db.order_archive_partitions.delete_one({"_id": partition_id})
+        await db[collection].drop()
+        return
+    await db.order_archive_partitions.replace_one({"_id": partition_id}, {
+        "_id": partition_id,
+        "collection": collection,
+        "first_date": first_date,
+        "last_date": last_date,
+        "months": sorted(months),
+        "order_count": order_count,
+        "aggregates": aggregates,
+        "frozen_at": datetime.now(timezone.utc).isoformat()
+    }, upsert=True)
+
+async def archive_closed_orders(older_than_months: int) -> Dict[str, Any]:
+    """Move closed orders dated before the start of (current month - N) into partitions.
+
+    Each batch is upserted into its partition before being deleted from the hot
+    collection, so an interrupted run can simply be repeated.
+    """
+    today = datetime.now(timezone.utc).date()
+    year, month = today.year, today.month - older_than_months
+    while month <= 0:
+        month += 12
+        year -= 1
+    cutoff = f"{year:04d}-{month:02d}-01"
+    query = {"status": {"$in": ARCHIVE_STATUSES}, **order_date_before(cutoff)}
+    
+    touched = set()
+    archived = 0
+    batch = []
+    
+    async def flush():
+        nonlocal archived
+        by_partition: Dict[str, List[Dict[str, Any]]] = {}
+        for order in batch:
+            by_partition.setdefault(archive_partition_id(stored_order_date(order)), []).append(order)
+        for partition_id, orders in by_partition.items():
+            collection = db[archive_collection(partition_id)]
+            if partition_id not in touched:
+                await collection.create_index("id", unique=True)
+                await ensure_order_search_indexes(collection)
+                touched.add(partition_id)
+            await collection.bulk_write([ReplaceOne({"id": o["id"]}, o, upsert=True) for o in orders], ordered=False)
+            await db.order_archive_index.bulk_write(
+                [UpdateOne({"_id": o["id"]}, {"$set": {"partition": partition_id}}, upsert=True) for o in orders],
+                ordered=False
+            )
+        await db.orders.delete_many({"id": {"$in": [o["id"] for o in batch]}})
+        archived += len(batch)
+        batch.clear()
+    
+    async for order in db.orders.find(query, {"_id": 0}):
+        if not archive_partition_id(stored_order_date(order)):
+            continue
+        batch.append(order)
+        if len(batch) >= ARCHIVE_BATCH_SIZE:
+            await flush()
+    if batch:
+        await flush()
+    
+    for partition_id in touched:
+        await freeze_partition(partition_id)
+    return {"cutoff": cutoff, "archived": archived, "partitions": sorted(touched)}
+
+@api_router.post("/admin/archive", dependencies=[Depends(require_admin)])
+async def run_archive(older_than_months: int = Query(ARCHIVE_AFTER_MONTHS, ge=1)):
+    """Archive closed orders older than N months"""
+    return await archive_closed_orders(older_than_months)
+
+@api_router.get("/admin/archive", dependencies=[Depends(require_admin)])
+async def get_archive_partitions():
+    """List archive partitions"""
+    return await db.order_archive_partitions.find({}, {"aggregates": 0}).sort("_id", -1).to_list(None)
+
 # ========== MAIN ==========
 
 @api_router.get("/")
@@ -665,6 +2629,17 @@ class TTNResponse(BaseModel):
 
 # ========== NOVA POSHTA API HELPERS ==========
 
+# 4xx statuses that mean "try again later" rather than "this request is wrong"
+NOVA_POSHTA_RETRYABLE_STATUSES = {408, 425, 429}
+
+def nova_poshta_client():
+    """Shared Nova Poshta HTTP client, created on first use so connections are reused"""
+    http = getattr(app.state, "nova_poshta_client", None)
+    if http is None:
+        import httpx
+        http = app.state.nova_poshta_client = httpx.AsyncClient(timeout=30.0)
+    return http
+
 async def nova_poshta_request(model_name: str, called_method: str, method_properties: Dict[str, Any], api_key: str = None) -> Dict:
     """Make a request to Nova Poshta API"""
     key = api_key or NOVA_POSHTA_API_KEY
@@ -678,22 +2653,257 @@ async def nova_poshta_request(model_name: str, called_method: str, method_proper
         "methodProperties": method_properties
     }
     
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        response = await client.post(NOVA_POSHTA_API_URL, json=payload)
+    start = time.perf_counter()
+    try:
+        response = await nova_poshta_client().post(NOVA_POSHTA_API_URL, json=payload)
+        # A rejected request stays rejected; only timeouts, rate limits and
+        # 5xx are worth retrying, and raise_for_status leaves those transient
+        if 400 <= response.status_code < 500 and response.status_code not in NOVA_POSHTA_RETRYABLE_STATUSES:
+            raise HTTPException(status_code=400,
+                                detail=f"Нова Пошта відхилила запит (HTTP {response.status_code})")
+        response.raise_for_status()
         data = response.json()
-        
-        if not data.get("success"):
-            errors = data.get("errors", ["Невідома помилка"])
-            raise HTTPException(status_code=400, detail=f"Помилка Нової Пошти: {', '.join(errors)}")
-        
-        return data.get("data", [])
+    except Exception as e:
+        NOVA_POSHTA_ERRORS.inc(model_name=model_name, called_method=called_method, reason=type(e).__name__)
+        raise
+    finally:
+        NOVA_POSHTA_DURATION.observe(time.perf_counter() - start, model_name=model_name, called_method=called_method)
+    
+    if not data.get("success"):
+        NOVA_POSHTA_ERRORS.inc(model_name=model_name, called_method=called_method, reason="api_error")
+        errors = data.get("errors", ["Невідома помилка"])
+        raise HTTPException(status_code=400, detail=f"Помилка Нової Пошти: {', '.join(errors)}")
+    
+    return data.get("data", [])
+
+# ========== NOVA POSHTA JOBS ==========
+
+# Nova Poshta writes run as jobs persisted in np_jobs and executed by background
+# workers, so the HTTP request only enqueues them. A job is claimed with a lease
+# (`available_at` is its expiry while running), so jobs of a worker that died
+# are picked up again after a restart. Handlers record each completed upstream
+# call in `steps`, and a retry resumes after it instead of repeating it. A call
+# that must never repeat (creating a waybill) is also marked before it is made;
+# a retry that finds the mark but no result reconciles with Nova Poshta first.
+
+NP_JOB_HANDLERS: Dict[str, Any] = {}
+np_job_wakeup = asyncio.Event()
+
+def np_job_view(job: Dict) -> Dict:
+    return {
+        "id": job["_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "order_id": job.get("order_id"),
+        "attempts": job.get("attempts", 0),
+        "max_attempts": job.get("max_attempts", NP_JOB_MAX_ATTEMPTS),
+        "last_error": job.get("last_error"),
+        "next_attempt_at": job.get("available_at") if job["status"] == "queued" else None,
+        "result": job.get("result"),
+        "created_at": job.get("created_at"),
+        "updated_at": job.get("updated_at"),
+    }
+
+async def enqueue_np_job(kind: str, payload: Dict, order_id: Optional[str] = None) -> Dict:
+    now = datetime.now(timezone.utc)
+    job = {
+        "_id": str(uuid.uuid4()),
+        "kind": kind,
+        "status": "queued",
+        "payload": payload,
+        "order_id": order_id,
+        "steps": {},
+        "attempts": 0,
+        "max_attempts": NP_JOB_MAX_ATTEMPTS,
+        "available_at": now,
+        "created_at": now,
+        "updated_at": now,
+    }
+    await db.np_jobs.insert_one(job)
+    NOVA_POSHTA_JOBS.inc(kind=kind, outcome="enqueued")
+    np_job_wakeup.set()
+    return np_job_view(job)
+
+async def claim_np_job() -> Optional[Dict]:
+    now = datetime.now(timezone.utc)
+    return await db.np_jobs.find_one_and_update(
+        # Running jobs past their lease belong to a worker that is gone
+        {"status": {"$in": ["queued", "running"]}, "available_at": {"$lte": now}},
+        {
+            "$set": {"status": "running", "available_at": now + timedelta(seconds=NP_JOB_LEASE_SECONDS), "updated_at": now},
+            "$inc": {"attempts": 1}
+        },
+        sort=[("available_at", 1)],
+        return_document=True
+    )
+
+async def save_np_job_step(job: Dict, step: str, value: Dict):
+    job["steps"][step] = value
+    await db.np_jobs.update_one(
+        {"_id": job["_id"]},
+        {"$set": {f"steps.{step}": value, "updated_at": datetime.now(timezone.utc)}}
+    )
+
+async def begin_np_job_step(job: Dict, marker: str):
+    """Mark an upstream call that must not repeat as started, renewing the lease.
+
+    Fails if the lease was lost to another worker, so only the job's current
+    claim makes the call. The HTTP client timeout is well within the lease.
+    """
+    now = datetime.now(timezone.utc)
+    value = {"started_at": now}
+    result = await db.np_jobs.update_one(
+        {"_id": job["_id"], "status": "running", "attempts": job["attempts"]},
+        {"$set": {
+            f"steps.{marker}": value,
+            "available_at": now + timedelta(seconds=NP_JOB_LEASE_SECONDS),
+            "updated_at": now
+        }}
+    )
+    if not result.matched_count:
+        raise RuntimeError("Завдання перехопив інший обробник")
+    job["steps"][marker] = value
+
+def np_job_backoff(attempts: int) -> float:
+    return min(NP_JOB_BACKOFF_SECONDS * 2 ** (attempts - 1), NP_JOB_BACKOFF_MAX_SECONDS)
+
+async def run_np_job(job: Dict):
+    kind = job["kind"]
+    # Conditional on the claim, so a job whose lease expired meanwhile isn't overwritten
+    claimed = {"_id": job["_id"], "status": "running", "attempts": job["attempts"]}
+    try:
+        if job["attempts"] > job["max_attempts"]:
+            # Lease expired on the last attempt, e.g. the process kept crashing
+            raise RuntimeError("Завдання перервано")
+        result = await NP_JOB_HANDLERS[kind](job)
+    except asyncio.CancelledError:
+        # Shutting down: hand the job back now instead of after the lease
+        await db.np_jobs.update_one(claimed, {
+            "$set": {"status": "queued", "available_at": datetime.now(timezone.utc)},
+            "$inc": {"attempts": -1}
+        })
+        raise
+    except Exception as e:
+        now = datetime.now(timezone.utc)
+        error = e.detail if isinstance(e, HTTPException) else f"{type(e).__name__}: {e}"
+        # Nova Poshta rejecting the request won't change on retry; network and
+        # upstream outages, timeouts and database errors may
+        permanent = isinstance(e, HTTPException) and e.status_code < 500
+        if permanent or job["attempts"] >= job["max_attempts"]:
+            await db.np_jobs.update_one(claimed, {"$set": {
+                "status": "failed", "last_error": error, "finished_at": now, "updated_at": now
+            }})
+            NOVA_POSHTA_JOBS.inc(kind=kind, outcome="failed")
+            logger.warning(f"Nova Poshta job {job['_id']} ({kind}) failed: {error}")
+        else:
+            await db.np_jobs.update_one(claimed, {"$set": {
+                "status": "queued",
+                "last_error": error,
+                "available_at": now + timedelta(seconds=np_job_backoff(job["attempts"])),
+                "updated_at": now
+            }})
+            NOVA_POSHTA_JOBS.inc(kind=kind, outcome="retried")
+        return
+
+    now = datetime.now(timezone.utc)
+    await db.np_jobs.update_one(claimed, {"$set": {
+        "status": "succeeded", "result": jsonable_encoder(result), "last_error": None,
+        "finished_at": now, "updated_at": now
+    }})
+    NOVA_POSHTA_JOBS.inc(kind=kind, outcome="succeeded")
+
+async def np_job_worker():
+    while True:
+        # Cleared before claiming, so a job enqueued meanwhile still wakes us
+        np_job_wakeup.clear()
+        try:
+            job = await claim_np_job()
+            if job:
+                await run_np_job(job)
+                continue
+        except Exception:
+            logger.exception("Nova Poshta job worker error")
+        try:
+            await asyncio.wait_for(np_job_wakeup.wait(), timeout=NP_JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+@api_router.get("/nova-poshta/jobs")
+async def get_np_jobs(order_id: Optional[str] = None, status: Optional[str] = None):
+    """List recent Nova Poshta jobs, optionally by order or status"""
+    query = {}
+    if order_id:
+        query["order_id"] = order_id
+    if status:
+        query["status"] = status
+    jobs = await db.np_jobs.find(query, {"payload": 0, "steps": 0}).sort("created_at", -1).to_list(100)
+    return [np_job_view(job) for job in jobs]
+
+@api_router.get("/nova-poshta/jobs/{job_id}")
+async def get_np_job(job_id: str):
+    """Get the state of a Nova Poshta job"""
+    job = await db.np_jobs.find_one({"_id": job_id}, {"payload": 0, "steps": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Завдання не знайдено")
+    return np_job_view(job)
+
+@api_router.post("/nova-poshta/jobs/{job_id}/retry")
+async def retry_np_job(job_id: str):
+    """Queue a failed job again; completed steps are not repeated"""
+    now = datetime.now(timezone.utc)
+    job = await db.np_jobs.find_one_and_update(
+        {"_id": job_id, "status": "failed"},
+        {
+            "$set": {"status": "queued", "attempts": 0, "available_at": now, "updated_at": now},
+            "$unset": {"finished_at": ""}
+        },
+        projection={"payload": 0, "steps": 0},
+        return_document=True
+    )
+    if not job:
+        if not await db.np_jobs.find_one({"_id": job_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Завдання не знайдено")
+        raise HTTPException(status_code=409, detail="Повторити можна лише завдання, що завершилося помилкою")
+    np_job_wakeup.set()
+    return np_job_view(job)
 
 # ========== NOVA POSHTA SETTINGS ==========
 
+class SettingsCache:
+    """One settings document held in memory for `ttl` seconds.
+
+    Saves in this process invalidate it right away; other processes see them
+    once their copy expires.
+    """
+
+    def __init__(self, name: str, collection: str, doc_id: str, ttl: float):
+        self.name = name
+        self.collection = collection
+        self.doc_id = doc_id
+        self.ttl = ttl
+        self._value: Optional[Dict[str, Any]] = None
+        self._loaded_at: Optional[float] = None
+
+    async def get(self) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at < self.ttl:
+            CACHE_REQUESTS.inc(cache=self.name, result="hit")
+        else:
+            CACHE_REQUESTS.inc(cache=self.name, result="miss")
+            self._value = await db[self.collection].find_one({"id": self.doc_id}, {"_id": 0})
+            self._loaded_at = now
+        # Callers get their own copy to modify
+        return dict(self._value) if self._value else None
+
+    def invalidate(self):
+        self._loaded_at = None
+
+np_settings_cache = SettingsCache("np_settings", "nova_poshta_settings", "nova_poshta_settings", NP_SETTINGS_TTL_SECONDS)
+
 @api_router.get("/nova-poshta/settings")
 async def get_np_settings():
     """Get Nova Poshta settings"""
-    settings = await db.nova_poshta_settings.find_one({"id": "nova_poshta_settings"}, {"_id": 0})
+    settings = await np_settings_cache.get()
     if not settings:
         return {"api_key": "", "configured": False}
     # Mask API key for security
@@ -759,6 +2969,7 @@ async def save_np_settings(api_key: str = None, sender_phone: str = None):
         {"$set": settings},
         upsert=True
     )
+    np_settings_cache.invalidate()
     
     return {"message": "Налаштування збережено", "settings": settings}
 
@@ -767,7 +2978,7 @@ async def save_np_settings(api_key: str = None, sender_phone: str = None):
 @api_router.get("/nova-poshta/cities")
 async def search_cities(search: str = "", limit: int = 20):
     """Search cities in Nova Poshta"""
-    settings = await db.nova_poshta_settings.find_one({"id": "nova_poshta_settings"}, {"_id": 0})
+    settings = await np_settings_cache.get()
     api_key = settings.get("api_key") if settings else NOVA_POSHTA_API_KEY
     
     data = await nova_poshta_request(
@@ -781,7 +2992,7 @@ async def search_cities(search: str = "", limit: int = 20):
 @api_router.get("/nova-poshta/warehouses")
 async def get_warehouses(city_ref: str, search: str = "", limit: int = 50):
     """Get warehouses (відділення) in a city"""
-    settings = await db.nova_poshta_settings.find_one({"id": "nova_poshta_settings"}, {"_id": 0})
+    settings = await np_settings_cache.get()
     api_key = settings.get("api_key") if settings else NOVA_POSHTA_API_KEY
     
     props = {"CityRef": city_ref, "Limit": str(limit)}
@@ -795,7 +3006,7 @@ async def get_warehouses(city_ref: str, search: str = "", limit: int = 50):
 @api_router.get("/nova-poshta/senders")
 async def get_senders():
     """Get sender counterparties from user's Nova Poshta account"""
-    settings = await db.nova_poshta_settings.find_one({"id": "nova_poshta_settings"}, {"_id": 0})
+    settings = await np_settings_cache.get()
     if not settings or not settings.get("api_key"):
         raise HTTPException(status_code=400, detail="API ключ не налаштовано")
     
@@ -870,17 +3081,57 @@ async def seed_dimension_templates():
 
 # ========== TTN (INTERNET DOCUMENTS) ==========
 
-@api_router.post("/nova-poshta/ttn")
-async def create_ttn(data: TTNCreate):
-    """Create a new TTN (shipping waybill) in Nova Poshta"""
-    settings = await db.nova_poshta_settings.find_one({"id": "nova_poshta_settings"}, {"_id": 0})
+async def get_np_sender_settings() -> Dict:
+    settings = await np_settings_cache.get()
     if not settings or not settings.get("api_key"):
         raise HTTPException(status_code=400, detail="API ключ Нової Пошти не налаштовано")
     
     if not settings.get("sender_ref"):
         raise HTTPException(status_code=400, detail="Дані відправника не налаштовано. Збережіть налаштування ще раз.")
-    
-    # Prepare TTN properties
+    return settings
+
+@api_router.post("/nova-poshta/ttn", status_code=202)
+async def create_ttn(data: TTNCreate, idempotency_key: Optional[str] = Header(None)):
+    """Queue creation of a TTN (shipping waybill) in Nova Poshta; poll the returned job"""
+    # Fail fast on missing settings instead of queueing a job that can't run
+    await get_np_sender_settings()
+    return await run_idempotent(
+        "ttn", idempotency_key, data,
+        lambda: enqueue_np_job("create_ttn", data.model_dump(), data.order_id),
+        status_code=202
+    )
+
+def np_document_step(document: Dict) -> Dict:
+    return {
+        "number": document.get("IntDocNumber"),
+        "ref": document.get("Ref"),
+        "estimated_delivery": document.get("EstimatedDeliveryDate")
+    }
+
+async def find_job_document(job: Dict, settings: Dict) -> Optional[Dict]:
+    """Waybill an earlier attempt of the job created, found by the job id it was tagged with"""
+    started = job["steps"]["document_pending"]["started_at"]
+    documents = await nova_poshta_request("InternetDocument", "getDocumentList", {
+        # A day either side covers the sender's timezone in the document date
+        "DateTimeFrom": (started - timedelta(days=1)).strftime("%d.%m.%Y"),
+        "DateTimeTo": (started + timedelta(days=1)).strftime("%d.%m.%Y"),
+        "GetFullList": "1"
+    }, settings.get("api_key"))
+    return next((d for d in documents if d.get("InfoRegClientBarcodes") == job["_id"]), None)
+
+def ttn_recipient_properties(data: TTNCreate) -> Dict:
+    # Create recipient as private person
+    recipient_parts = data.recipient_name.split(" ", 2)
+    return {
+        "FirstName": recipient_parts[0] if len(recipient_parts) > 0 else "",
+        "MiddleName": recipient_parts[2] if len(recipient_parts) > 2 else "",
+        "LastName": recipient_parts[1] if len(recipient_parts) > 1 else "",
+        "Phone": data.recipient_phone,
+        "CounterpartyType": "PrivatePerson",
+        "CounterpartyProperty": "Recipient"
+    }
+
+def ttn_document_properties(data: TTNCreate, settings: Dict, recipient: Dict) -> Dict:
     properties = {
         "PayerType": data.payer_type,
         "PaymentMethod": data.payment_method,
@@ -897,9 +3148,9 @@ async def create_ttn(data: TTNCreate):
         "ContactSender": settings.get("sender_contact_ref"),
         "SendersPhone": settings.get("sender_phone", ""),
         "CityRecipient": data.recipient_city_ref,
-        "Recipient": "",  # Will be created as new
+        "Recipient": recipient.get("ref", ""),
         "RecipientAddress": data.recipient_warehouse_ref,
-        "ContactRecipient": "",
+        "ContactRecipient": recipient.get("contact_ref", ""),
         "RecipientsPhone": data.recipient_phone,
         "VolumeGeneral": str(round(data.length * data.width * data.height / 1000000, 4)),
         "OptionsSeat": [
@@ -913,91 +3164,103 @@ async def create_ttn(data: TTNCreate):
         ]
     }
     
-    # Create recipient as private person
-    recipient_parts = data.recipient_name.split(" ", 2)
-    recipient_props = {
-        "FirstName": recipient_parts[0] if len(recipient_parts) > 0 else "",
-        "MiddleName": recipient_parts[2] if len(recipient_parts) > 2 else "",
-        "LastName": recipient_parts[1] if len(recipient_parts) > 1 else "",
-        "Phone": data.recipient_phone,
-        "CounterpartyType": "PrivatePerson",
-        "CounterpartyProperty": "Recipient"
-    }
-    
-    try:
+    # Add COD if specified
+    if data.cod_amount and data.cod_amount > 0:
+        properties["BackwardDeliveryData"] = [{
+            "PayerType": "Recipient",
+            "CargoType": "Money",
+            "RedeliveryString": str(data.cod_amount)
+        }]
+    return properties
+
+async def run_create_ttn_job(job: Dict) -> Dict:
+    data = TTNCreate(**job["payload"])
+    settings = await get_np_sender_settings()
+    steps = job["steps"]
+    
+    if "recipient" not in steps:
         # Create recipient counterparty
         recipient_data = await nova_poshta_request(
             "Counterparty",
             "save",
-            recipient_props,
-            settings.get("api_key")
-        )
-        
-        if recipient_data:
-            properties["Recipient"] = recipient_data[0].get("Ref")
-            properties["ContactRecipient"] = recipient_data[0].get("ContactPerson", {}).get("data", [{}])[0].get("Ref", "")
-        
-        # Add COD if specified
-        if data.cod_amount and data.cod_amount > 0:
-            properties["BackwardDeliveryData"] = [{
-                "PayerType": "Recipient",
-                "CargoType": "Money",
-                "RedeliveryString": str(data.cod_amount)
-            }]
-        
-        # Create internet document (TTN)
-        ttn_data = await nova_poshta_request(
-            "InternetDocument",
-            "save",
-            properties,
+            ttn_recipient_properties(data),
             settings.get("api_key")
         )
-        
+        recipient = recipient_data[0] if recipient_data else {}
+        await save_np_job_step(job, "recipient", {
+            "ref": recipient.get("Ref", ""),
+            "contact_ref": recipient.get("ContactPerson", {}).get("data", [{}])[0].get("Ref", "")
+        })
+    
+    if "document" not in steps and "document_pending" in steps:
+        # An earlier attempt may have created the waybill and then died before
+        # recording it: look it up instead of creating another
+        document = await find_job_document(job, settings)
+        if document:
+            await save_np_job_step(job, "document", np_document_step(document))
+    
+    if "document" not in steps:
+        await begin_np_job_step(job, "document_pending")
+        # Create internet document (TTN), tagged with the job so it can be found again
+        properties = ttn_document_properties(data, settings, steps["recipient"])
+        properties["InfoRegClientBarcodes"] = job["_id"]
+        ttn_data = await nova_poshta_request("InternetDocument", "save", properties, settings.get("api_key"))
         if not ttn_data:
             raise HTTPException(status_code=400, detail="Не вдалося створити ТТН")
-        
-        ttn_info = ttn_data[0]
-        
-        # Save TTN to database
-        ttn_record = {
-            "id": str(uuid.uuid4()),
-            "order_id": data.order_id,
-            "ttn_number": ttn_info.get("IntDocNumber"),
-            "ttn_ref": ttn_info.get("Ref"),
-            "recipient_name": data.recipient_name,
-            "recipient_phone": data.recipient_phone,
-            "recipient_city": data.recipient_city_name or "",
-            "recipient_warehouse": data.recipient_warehouse_name or "",
-            "weight": data.weight,
-            "description": data.description,
-            "cost": data.cost,
-            "cod_amount": data.cod_amount,
-            "estimated_delivery": ttn_info.get("EstimatedDeliveryDate"),
-            "status": "created",
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "print_url": f"https://my.novaposhta.ua/orders/printDocument/orders[]/{ttn_info.get('Ref')}/type/pdf"
-        }
-        
-        await db.ttns.insert_one(ttn_record)
-        
-        # Update order with TTN info if order_id provided
-        if data.order_id:
-            await db.orders.update_one(
-                {"id": data.order_id},
-                {"$set": {
-                    "ttn_number": ttn_info.get("IntDocNumber"),
-                    "ttn_ref": ttn_info.get("Ref"),
-                    "delivery_status": "created"
-                }}
-            )
-        
-        return ttn_record
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error creating TTN: {e}")
-        raise HTTPException(status_code=500, detail=f"Помилка створення ТТН: {str(e)}")
+        await save_np_job_step(job, "document", np_document_step(ttn_data[0]))
+    
+    return await apply_ttn_document(job["_id"], data, steps["document"])
+
+async def apply_ttn_document(job_id: str, data: TTNCreate, document: Dict) -> Dict:
+    """Save a created waybill to ttns and its order; safe to repeat for one job"""
+    ttn_record = {
+        "id": str(uuid.uuid4()),
+        "job_id": job_id,
+        "order_id": data.order_id,
+        "ttn_number": document["number"],
+        "ttn_ref": document["ref"],
+        "recipient_name": data.recipient_name,
+        "recipient_phone": data.recipient_phone,
+        "recipient_city": data.recipient_city_name or "",
+        "recipient_warehouse": data.recipient_warehouse_name or "",
+        "weight": data.weight,
+        "description": data.description,
+        "cost": data.cost,
+        "cod_amount": data.cod_amount,
+        "estimated_delivery": document.get("estimated_delivery"),
+        "status": "created",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "print_url": f"https://my.novaposhta.ua/orders/printDocument/orders[]/{document['ref']}/type/pdf"
+    }
+    saved = await db.ttns.find_one_and_update(
+        {"job_id": job_id},
+        {"$setOnInsert": ttn_record},
+        projection={"_id": 0},
+        upsert=True,
+        return_document=True
+    )
+    
+    # Update order with TTN info if order_id provided
+    if data.order_id:
+        await set_order_ttn(data.order_id, document)
+    
+    return saved
+
+async def set_order_ttn(order_id: str, document: Dict):
+    """Record a waybill on its order, in the hot collection or the archive partition holding it"""
+    fields = {"ttn_number": document["number"], "ttn_ref": document["ref"], "delivery_status": "created"}
+    result = await db.orders.update_one({"id": order_id}, {"$set": fields})
+    if not result.matched_count:
+        # Waybill fields don't feed the frozen summaries, so the order stays archived
+        partition_id = await locate_archived_order(order_id)
+        if partition_id:
+            result = await db[archive_collection(partition_id)].update_one({"id": order_id}, {"$set": fields})
+    if not result.matched_count:
+        # The document step is saved, so failing here never creates a second waybill
+        raise HTTPException(status_code=404,
+                            detail=f"ТТН {document['number']} створено, але замовлення {order_id} не знайдено")
+
+NP_JOB_HANDLERS["create_ttn"] = run_create_ttn_job
 
 @api_router.get("/nova-poshta/ttns")
 async def get_ttns(order_id: Optional[str] = None):
@@ -1012,7 +3275,7 @@ async def get_ttns(order_id: Optional[str] = None):
 @api_router.get("/nova-poshta/track/{ttn_number}")
 async def track_ttn(ttn_number: str):
     """Track a TTN status"""
-    settings = await db.nova_poshta_settings.find_one({"id": "nova_poshta_settings"}, {"_id": 0})
+    settings = await np_settings_cache.get()
     api_key = settings.get("api_key") if settings else NOVA_POSHTA_API_KEY
     
     data = await nova_poshta_request(
@@ -1041,22 +3304,90 @@ async def get_print_url(ttn_ref: str):
         "sticker_url": f"https://my.novaposhta.ua/orders/printMarkings/orders[]/{ttn_ref}/type/pdf"
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 app.include_router(api_router)
 
+# Inside CORS, so browsers can read the 503s it sends
+app.add_middleware(ConcurrencyLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+async def ensure_indexes():
+    await db.idempotency_keys.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS)
+    await db.order_archive_partitions.create_index("months")
+    await db.order_archive_partitions.create_index([("last_date", -1), ("first_date", 1)])
+    await ensure_order_search_indexes(db.orders)
+    await db.price_history.create_index([("size", 1), ("effective_from", 1)])
+    await db.price_history.create_index("price_id")
+    await db.np_jobs.create_index([("status", 1), ("available_at", 1)])
+    await db.np_jobs.create_index("order_id")
+    await db.np_jobs.create_index("finished_at", expireAfterSeconds=NP_JOB_TTL_SECONDS)
+    await db.ttns.create_index("job_id", unique=True, sparse=True)
+
+async def prepare_database():
+    """Create indexes and backfill derived data, retrying while MongoDB is unreachable"""
+    while True:
+        try:
+            await ensure_indexes()
+            await backfill_price_history()
+            break
+        except Exception as e:
+            logger.warning(f"Database setup failed, retrying in {STARTUP_RETRY_SECONDS:g}s: {e}")
+            await asyncio.sleep(STARTUP_RETRY_SECONDS)
+    await backfill_all_search_fields()
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # Database setup runs in the background like warm_up, so an unreachable
+    # MongoDB at boot doesn't keep the app from starting
+    app.state.database_setup = asyncio.create_task(prepare_database())
+    app.state.np_job_workers = [asyncio.create_task(np_job_worker()) for _ in range(NP_JOB_WORKERS)]
+
+@app.on_event("startup")
+async def warm_up():
+    """Preload what the first requests would otherwise wait for"""
+    started = time.perf_counter()
+    steps = {
+        "mongodb connection": lambda: client.admin.command("ping"),
+        "price index": price_index.ensure_loaded,
+        "nova poshta settings": np_settings_cache.get,
+    }
+    for name, step in steps.items():
+        try:
+            await step()
+        except Exception as e:
+            # A cold cache is slower, not broken; let the app start anyway
+            logger.warning(f"Warm-up of {name} failed: {e}")
+    logger.info(f"Warm-up done in {time.perf_counter() - started:.2f}s")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    workers = getattr(app.state, "np_job_workers", [])
+    if getattr(app.state, "database_setup", None) is not None:
+        app.state.database_setup.cancel()
+    for worker in workers:
+        worker.cancel()
+    # Lets workers hand their jobs back before the client closes
+    await asyncio.gather(*workers, return_exceptions=True)
+    if getattr(app.state, "nova_poshta_client", None) is not None:
+        await app.state.nova_poshta_client.aclose()
     client.close()
@@ -0,0 +1,91 @@
+"""ConcurrencyLimiter admission order and the middleware's 503 responses"""
+import asyncio
+
+import httpx
+
+import server
+
+def limited_client(monkeypatch, limiter: server.ConcurrencyLimiter, gate: asyncio.Event) -> httpx.AsyncClient:
+    """Client for an app whose requests wait for gate, behind ConcurrencyLimitMiddleware"""
+    async def app(scope, receive, send):
+        await gate.wait()
+        await server.JSONResponse({"ok": True})(scope, receive, send)
+
+    monkeypatch.setattr(server, "concurrency_limiters", {"crud": limiter})
+    transport = httpx.ASGITransport(app=server.ConcurrencyLimitMiddleware(app))
+    return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+async def wait_for_queue(limiter: server.ConcurrencyLimiter, depth: int):
+    while limiter.waiting < depth:
+        await asyncio.sleep(0)
+
+def test_queue_full_is_refused_with_503(monkeypatch):
+    async def scenario():
+        limiter = server.ConcurrencyLimiter("crud", limit=1, queue=1, queue_timeout=5, retry_after=7)
+        gate = asyncio.Event()
+        async with limited_client(monkeypatch, limiter, gate) as client:
+            running = asyncio.create_task(client.get("/api/orders"))
+            queued = asyncio.create_task(client.get("/api/orders"))
+            await wait_for_queue(limiter, 1)
+
+            refused = await client.get("/api/orders")
+            assert refused.status_code == 503
+            assert refused.headers["Retry-After"] == "7"
+            assert refused.json() == {"detail": "Сервер перевантажено, спробуйте пізніше"}
+
+            gate.set()
+            assert [r.status_code for r in await asyncio.gather(running, queued)] == [200, 200]
+    asyncio.run(scenario())
+
+def test_queue_timeout_is_refused_with_503(monkeypatch):
+    async def scenario():
+        limiter = server.ConcurrencyLimiter("crud", limit=1, queue=5, queue_timeout=0.05, retry_after=2)
+        gate = asyncio.Event()
+        async with limited_client(monkeypatch, limiter, gate) as client:
+            running = asyncio.create_task(client.get("/api/orders"))
+            await asyncio.sleep(0.01)
+
+            timed_out = await client.get("/api/orders")
+            assert timed_out.status_code == 503
+            assert timed_out.headers["Retry-After"] == "2"
+            assert limiter.waiting == 0
+
+            gate.set()
+            assert (await running).status_code == 200
+    asyncio.run(scenario())
+
+def test_unlimited_routes_pass_through(monkeypatch):
+    async def scenario():
+        limiter = server.ConcurrencyLimiter("crud", limit=1, queue=0, queue_timeout=5, retry_after=1)
+        gate = asyncio.Event()
+        async with limited_client(monkeypatch, limiter, gate) as client:
+            running = asyncio.create_task(client.get("/api/orders"))
+            await asyncio.sleep(0.01)
+            assert (await client.get("/api/orders")).status_code == 503
+            gate.set()
+            assert (await client.get("/health")).status_code == 200
+            await running
+    asyncio.run(scenario())
+
+def test_queued_requests_are_admitted_in_arrival_order():
+    async def scenario():
+        limiter = server.ConcurrencyLimiter("crud", limit=1, queue=5, queue_timeout=5, retry_after=1)
+        admitted = []
+
+        async def request(name: str):
+            assert await limiter.acquire() is None
+            admitted.append(name)
+            await asyncio.sleep(0.01)
+            limiter.release()
+
+        assert await limiter.acquire() is None
+        queued = []
+        for name in ("a", "b", "c"):
+            queued.append(asyncio.create_task(request(name)))
+            await wait_for_queue(limiter, len(queued))
+        # Arrives as the slot frees up, before "a" has woken: it still queues behind a, b and c
+        limiter.release()
+        await request("late")
+        await asyncio.gather(*queued)
+        assert admitted == ["a", "b", "c", "late"]
+    asyncio.run(scenario())
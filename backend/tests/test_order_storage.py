@@ -0,0 +1,103 @@
+"""Compact order storage: legacy -> compact -> API round trips and the migration"""
+import bson
+import mongomock
+import pytest
+
+import server
+from migrations import compact_orders
+
+ITEM = {"size": "30х40", "product_id": None, "product_name": None, "quantity": 1, "unit_price": 650.0,
+        "unit_cost": 240.0, "with_lacquer": False, "with_packaging": False, "frame_type": None,
+        "lacquer_price": 0.0, "lacquer_cost": 0.0, "packaging_price": 0.0, "packaging_cost": 0.0,
+        "frame_price": 0.0, "frame_cost": 0.0, "total_price": 650.0, "total_cost": 240.0, "profit": 410.0}
+PRODUCT_ITEM = {**ITEM, "size": "40х50", "product_id": "p-7", "product_name": "Соняшники", "quantity": 3,
+                "unit_price": 1049.99, "unit_cost": 290.0, "with_lacquer": True, "with_packaging": True,
+                "frame_type": "11-14", "lacquer_price": 120.0, "lacquer_cost": 35.0, "packaging_price": 130.0,
+                "packaging_cost": 35.0, "frame_price": 470.0, "frame_cost": 235.0, "total_price": 5309.97,
+                "total_cost": 1785.0, "profit": 3524.97}
+
+def legacy_order(**overrides) -> dict:
+    order = {"id": "o-1", "order_date": "2026-03-14", "month": "Березень 2026", "painting_name": "Весна",
+             "order_type": "друк", "items": [ITEM], "total_amount": 650.0, "total_cost": 240.0, "profit": 410.0,
+             "sales_channel": "Instagram", "status": "нове", "comment": None,
+             "created_at": "2026-03-14T09:30:00.123000+00:00", "extra_income": 0.0,
+             "discounted_amount": None, "discount": 0.0, "net_income": 650.0}
+    order.update(overrides)
+    return order
+
+def stored(doc: dict) -> dict:
+    """doc as MongoDB hands it back: BSON dates lose tzinfo and sub-millisecond digits"""
+    return bson.decode(bson.encode(doc))
+
+ORDERS = {
+    "plain": legacy_order(),
+    "discount_and_products": legacy_order(
+        items=[ITEM, PRODUCT_ITEM], total_amount=5959.97, total_cost=2025.0, profit=3934.97, extra_income=150.0,
+        discounted_amount=5500.0, discount=459.97, net_income=5650.0, comment="Подарунок, без чека"),
+    "timestamp": legacy_order(order_date="2026-03-31T21:45:10.250Z"),
+    "month_differs": legacy_order(order_date="2026-03-31T22:10:00.000Z", month="Квітень 2026"),
+    "bare_date_month_differs": legacy_order(month="Лютий 2026"),
+    "unparsed_date": legacy_order(order_date="14.03.2026", month="Березень 2026"),
+}
+
+@pytest.mark.parametrize("name", ORDERS)
+def test_round_trip(name):
+    order = ORDERS[name]
+    assert server.inflate_order(stored(server.compact_order(order))) == order
+
+def test_compact_shape():
+    doc = server.compact_order(ORDERS["discount_and_products"])
+    assert doc["_v"] == server.ORDER_SCHEMA_VERSION
+    assert "month" not in doc and "_ts" not in doc
+    assert doc["total_amount"] == 595997 and doc["discount"] == 45997
+    assert doc["items"][0] == {"size": "30х40", "unit_price": 65000, "unit_cost": 24000, "total_price": 65000,
+                               "total_cost": 24000, "profit": 41000}
+    assert doc["items"][1]["quantity"] == 3
+
+def test_compact_keeps_month_and_flags_timestamps():
+    doc = server.compact_order(ORDERS["month_differs"])
+    assert doc["month"] == "Квітень 2026" and doc["_ts"] is True
+    assert "month" not in server.compact_order(ORDERS["timestamp"])
+    assert server.compact_order(ORDERS["unparsed_date"])["order_date"] == "14.03.2026"
+
+@pytest.mark.parametrize("start,end", [("2026-03-14", "2026-03-14"), ("2026-03-14", "2026-03-14\uffff"),
+                                       ("2026-03-01", "2026-03-31T21:45:10.250Z"), ("2026-03-15", "2026-04-01")])
+def test_order_date_filter_matches_string_bounds(start, end):
+    collection = mongomock.MongoClient().db.orders
+    dates = ["2026-03-13", "2026-03-14", "2026-03-14T00:00:00.000Z", "2026-03-14T23:59:59.999Z",
+             "2026-03-31T21:45:10.250Z", "2026-03-31T21:45:10.251Z", "2026-04-01"]
+    for i, order_date in enumerate(dates):
+        collection.insert_one({"_id": i, **server.compact_order(legacy_order(order_date=order_date))})
+    matched = {server.stored_order_date(doc) for doc in collection.find(server.order_date_filter(start, end))}
+    assert matched == {d for d in dates if start <= d <= end}
+
+def test_migration_resumes_from_checkpoint(monkeypatch):
+    db = mongomock.MongoClient().kuvot_test
+    orders = [legacy_order(id=f"o-{i}", order_date=f"2026-03-{i + 10}T12:00:00.000Z") for i in range(5)]
+    db.orders.insert_many([{"_id": i, **order} for i, order in enumerate(orders)])
+
+    # Fail on the first order of the second batch, after the first was flushed
+    compact_order = compact_orders.compact_order
+    calls = []
+    def failing_compact_order(order):
+        calls.append(order["_id"])
+        if len(calls) == 3:
+            raise RuntimeError("interrupted")
+        return compact_order(order)
+    monkeypatch.setattr(compact_orders, "compact_order", failing_compact_order)
+    with pytest.raises(RuntimeError):
+        compact_orders.migrate_collection(db, "orders", batch_size=2, dry_run=False, restart=False)
+    assert db.migrations.find_one({"_id": "compact_orders:orders"})["last_id"] == 1
+    assert db.orders.count_documents({"_v": server.ORDER_SCHEMA_VERSION}) == 2
+
+    monkeypatch.setattr(compact_orders, "compact_order", compact_order)
+    stats = compact_orders.migrate_collection(db, "orders", batch_size=2, dry_run=False, restart=False)
+    assert stats["resumed_after"] == 1 and stats["migrated"] == 3
+    assert db.migrations.find_one({"_id": "compact_orders:orders"})["migrated"] == 5
+    assert [server.inflate_order(doc) for doc in db.orders.find({}, {"_id": 0}).sort("_id", 1)] == orders
+
+def test_compact_form_inflates_like_stored_form():
+    order = legacy_order(created_at="2026-03-14T09:30:00.123456+00:00", total_amount=0.1 + 0.2)
+    compact = server.compact_order(order)
+    assert server.inflate_order(compact) == server.inflate_order(stored(compact))
+    assert server.inflate_order(compact)["created_at"] == "2026-03-14T09:30:00.123000+00:00"
@@ -0,0 +1,106 @@
+"""QueryCache: single-flight computation, invalidation and the settle window"""
+import asyncio
+
+import pytest
+
+import server
+
+SCOPE = ("Березень 2026", None, None)
+
+@pytest.fixture
+def cache():
+    cache = server.QueryCache("test", ttl=60, max_entries=10)
+    yield cache
+    server.QUERY_CACHES.remove(cache)
+
+class Computation:
+    """compute() that blocks until released and counts its calls"""
+
+    def __init__(self):
+        self.calls = 0
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        self.started.set()
+        await self.release.wait()
+        return {"call": self.calls}
+
+def test_followers_join_inflight_computation(cache):
+    async def scenario():
+        compute = Computation()
+        leader = asyncio.create_task(cache.get_or_compute(("k",), SCOPE, compute))
+        await compute.started.wait()
+        followers = [asyncio.create_task(cache.get_or_compute(("k",), SCOPE, compute)) for _ in range(3)]
+        await asyncio.sleep(0)
+        compute.release.set()
+        results = await asyncio.gather(leader, *followers)
+        assert results == [{"call": 1}] * 4
+        assert compute.calls == 1
+        assert cache.stats["misses"] == 1 and cache.stats["coalesced"] == 3
+        assert await cache.get_or_compute(("k",), SCOPE, compute) == {"call": 1}
+        assert cache.stats["hits"] == 1
+    asyncio.run(scenario())
+
+def test_follower_computes_when_leader_is_cancelled(cache):
+    async def scenario():
+        compute = Computation()
+        leader = asyncio.create_task(cache.get_or_compute(("k",), SCOPE, compute))
+        await compute.started.wait()
+        follower = asyncio.create_task(cache.get_or_compute(("k",), SCOPE, compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        compute.release.set()
+        assert await follower == {"call": 2}
+        assert cache.snapshot()["entries"] == 1 and cache.snapshot()["in_flight"] == 0
+    asyncio.run(scenario())
+
+def test_invalidation_during_computation_is_not_cached(cache):
+    async def scenario():
+        stale = Computation()
+        leader = asyncio.create_task(cache.get_or_compute(("k",), SCOPE, stale))
+        await stale.started.wait()
+        cache.invalidate({"Березень 2026"}, set())
+        stale.release.set()
+        assert await leader == {"call": 1}
+        assert cache.snapshot()["entries"] == 0
+
+        fresh = Computation()
+        fresh.release.set()
+        await cache.get_or_compute(("k",), SCOPE, fresh)
+        assert fresh.calls == 1 and cache.snapshot()["entries"] == 1
+    asyncio.run(scenario())
+
+def test_requests_after_invalidation_do_not_join_stale_computation(cache):
+    async def scenario():
+        stale = Computation()
+        leader = asyncio.create_task(cache.get_or_compute(("k",), SCOPE, stale))
+        await stale.started.wait()
+        cache.invalidate({"Березень 2026"}, set())
+
+        fresh = Computation()
+        fresh.release.set()
+        await cache.get_or_compute(("k",), SCOPE, fresh)
+        assert fresh.calls == 1 and cache.stats["coalesced"] == 0
+        stale.release.set()
+        await leader
+    asyncio.run(scenario())
+
+def test_results_are_not_cached_within_settle_window(cache):
+    async def scenario():
+        cache.settle = 0.05
+        compute = Computation()
+        compute.release.set()
+        cache.invalidate(set(), {"2026-03-14"})
+        await cache.get_or_compute(("k",), SCOPE, compute)
+        await cache.get_or_compute(("k",), SCOPE, compute)
+        assert compute.calls == 2 and cache.stats["hits"] == 0
+
+        await asyncio.sleep(cache.settle)
+        await cache.get_or_compute(("k",), SCOPE, compute)
+        assert await cache.get_or_compute(("k",), SCOPE, compute) == {"call": 3}
+        assert compute.calls == 3 and cache.stats["hits"] == 1
+    asyncio.run(scenario())
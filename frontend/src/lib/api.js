@@ -10,10 +10,30 @@ const api = axios.create({
   },
 });
 
+// Busy route classes answer 503 with Retry-After; GETs are safe to repeat
+const MAX_OVERLOAD_RETRIES = 2;
+api.interceptors.response.use(null, async (error) => {
+  const { config, response } = error;
+  const retries = config?.overloadRetries || 0;
+  if (response?.status !== 503 || config.method !== 'get' || retries >= MAX_OVERLOAD_RETRIES) throw error;
+  const seconds = Number(response.headers['retry-after']) || 1;
+  await new Promise((resolve) => setTimeout(resolve, Math.min(seconds, 10) * 1000));
+  return api({ ...config, overloadRetries: retries + 1 });
+});
+
+// A key is generated once per logical submission and reused for its retries
+export const newIdempotencyKey = () =>
+  window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+
+const idempotencyHeaders = (key) => (key ? { 'Idempotency-Key': key } : {});
+
 // Prices
 export const getPrices = () => api.get('/prices');
 export const createPrice = (data) => api.post('/prices', data);
-export const updatePrice = (id, data) => api.put(`/prices/${id}`, data);
+// effectiveFrom: 'YYYY-MM-DD', defaults to today on the server; earlier dates rewrite history
+export const updatePrice = (id, data, effectiveFrom) =>
+  api.put(`/prices/${id}`, data, { params: { effective_from: effectiveFrom } });
+export const getPriceHistory = (params) => api.get('/prices/history', { params });
 export const deletePrice = (id) => api.delete(`/prices/${id}`);
 export const seedPrices = () => api.post('/prices/seed');
 
@@ -26,14 +46,53 @@ export const deleteProduct = (id) => api.delete(`/products/${id}`);
 // Orders
 export const getOrders = (params) => api.get('/orders', { params });
 export const getOrder = (id) => api.get(`/orders/${id}`);
-export const createOrder = (data) => api.post('/orders', data);
+// params: { q, mode: 'text' | 'prefix', page, page_size, ...filters }
+export const searchOrders = (params) => api.get('/orders/search', { params });
+export const createOrder = (data, idempotencyKey) =>
+  api.post('/orders', data, { headers: idempotencyHeaders(idempotencyKey) });
 export const updateOrder = (id, data) => api.put(`/orders/${id}`, data);
 export const deleteOrder = (id) => api.delete(`/orders/${id}`);
+// selection: { ids: [...] } or { filter: { month, order_date, order_type, size, status, sales_channel } }
+export const bulkUpdateStatus = (status, selection) => api.patch('/orders/bulk-status', { status, ...selection });
 
 // Analytics
 export const getAnalyticsSummary = (params) => api.get('/analytics/summary', { params });
 export const getDailyAnalytics = (date) => api.get('/analytics/daily', { params: { date_str: date } });
 export const getAvailableMonths = () => api.get('/analytics/months');
+// base: month label or 'YYYY-MM-DD..YYYY-MM-DD'; compare: array of periods in the same form
+export const compareAnalytics = (base, compare) =>
+  api.get('/analytics/compare', {
+    params: { base, compare },
+    paramsSerializer: { indexes: null },
+  });
+
+// Nova Poshta
+// Queues the waybill and returns a job; poll it with waitForNpJob
+export const createTtn = (data, idempotencyKey) =>
+  api.post('/nova-poshta/ttn', data, { headers: idempotencyHeaders(idempotencyKey) });
+export const getNpJob = (id) => api.get(`/nova-poshta/jobs/${id}`);
+// Resolves with the finished job ("succeeded" or "failed"), or the last state seen after `timeout` ms
+export const waitForNpJob = async (id, { interval = 1000, timeout = 60000 } = {}) => {
+  const deadline = Date.now() + timeout;
+  for (;;) {
+    const { data: job } = await getNpJob(id);
+    if (job.status === 'succeeded' || job.status === 'failed' || Date.now() >= deadline) return job;
+    await new Promise((resolve) => setTimeout(resolve, interval));
+  }
+};
+
+// Batch: several GET requests in one round trip.
+// requests: [{ id, path: '/analytics/summary', params }] -> { [id]: { status, data } }
+export const batchGet = async (requests) => {
+  const res = await api.post('/batch', {
+    requests: requests.map(({ id, path, params }) => ({
+      id,
+      path: `/api${path}`,
+      params: Object.fromEntries(Object.entries(params || {}).filter(([, v]) => v !== undefined && v !== '')),
+    })),
+  });
+  return Object.fromEntries(res.data.responses.map(({ id, status, body }) => [id, { status, data: body }]));
+};
 
 // Export
 export const exportToExcel = (params) => {
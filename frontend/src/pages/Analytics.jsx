@@ -8,7 +8,7 @@ import {
   SelectValue,
 } from "../components/ui/select";
 import { RefreshCw } from "lucide-react";
-import { getAnalyticsSummary, getAvailableMonths } from "../lib/api";
+import { getAnalyticsSummary, getAvailableMonths, compareAnalytics } from "../lib/api";
 import { formatCurrency } from "../lib/utils";
 import {
   BarChart,
@@ -43,12 +43,37 @@ export function Analytics() {
   const [months, setMonths] = useState([]);
   const [selectedMonth, setSelectedMonth] = useState("");
   const [compareMonth, setCompareMonth] = useState("");
+  const [comparison, setComparison] = useState(null);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
     loadData();
   }, [selectedMonth]);
 
+  useEffect(() => {
+    if (!selectedMonth || !compareMonth) {
+      setComparison(null);
+      return;
+    }
+    compareAnalytics(selectedMonth, [compareMonth])
+      .then((res) => setComparison(res.data.comparisons[0]))
+      .catch((error) => console.error("Error loading comparison:", error));
+  }, [selectedMonth, compareMonth]);
+
+  const renderDelta = (metric) => {
+    const pct = comparison?.delta_pct?.[metric];
+    if (pct === undefined) return null;
+    if (pct === null) {
+      return <p className="text-xs text-muted-foreground mt-1">— до {comparison.period}</p>;
+    }
+    const color = pct >= 0 ? "text-green-600 dark:text-green-400" : "text-red-600 dark:text-red-400";
+    return (
+      <p className={`text-xs mt-1 tabular-nums ${color}`}>
+        {pct > 0 ? "+" : ""}{pct}% до {comparison.period}
+      </p>
+    );
+  };
+
   const loadData = async () => {
     setLoading(true);
     try {
@@ -131,6 +156,23 @@ export function Analytics() {
           </p>
         </div>
         <div className="flex items-center gap-3">
+          <Select
+            value={compareMonth || "none"}
+            onValueChange={(v) => setCompareMonth(v === "none" ? "" : v)}
+            disabled={!selectedMonth}
+          >
+            <SelectTrigger className="w-[200px]" data-testid="analytics-compare-filter">
+              <SelectValue placeholder="Без порівняння" />
+            </SelectTrigger>
+            <SelectContent>
+              <SelectItem value="none">Без порівняння</SelectItem>
+              {months.filter((month) => month !== selectedMonth).map((month) => (
+                <SelectItem key={month} value={month}>
+                  {month}
+                </SelectItem>
+              ))}
+            </SelectContent>
+          </Select>
           <Select value={selectedMonth || "all"} onValueChange={(v) => setSelectedMonth(v === "all" ? "" : v)}>
             <SelectTrigger className="w-[200px]" data-testid="analytics-month-filter">
               <SelectValue placeholder="Всі місяці" />
@@ -157,6 +199,7 @@ export function Analytics() {
             <p className="text-xl font-bold mt-1 tabular-nums">
               {formatCurrency(analytics?.total_revenue || 0)}
             </p>
+            {renderDelta("total_revenue")}
           </CardContent>
         </Card>
         <Card data-testid="analytics-cost">
@@ -167,6 +210,7 @@ export function Analytics() {
             <p className="text-xl font-bold mt-1 tabular-nums text-orange-600 dark:text-orange-400">
               {formatCurrency(analytics?.total_cost || 0)}
             </p>
+            {renderDelta("total_cost")}
           </CardContent>
         </Card>
         <Card data-testid="analytics-profit">
@@ -177,6 +221,7 @@ export function Analytics() {
             <p className="text-xl font-bold mt-1 tabular-nums text-green-600 dark:text-green-400">
               {formatCurrency(analytics?.total_profit || 0)}
             </p>
+            {renderDelta("total_profit")}
           </CardContent>
         </Card>
         <Card data-testid="analytics-margin">
@@ -10,7 +10,7 @@ import {
   ArrowDownRight,
   RefreshCw,
 } from "lucide-react";
-import { getAnalyticsSummary, getDailyAnalytics, getAvailableMonths, seedPrices } from "../lib/api";
+import { batchGet, seedPrices } from "../lib/api";
 import { formatCurrency, formatNumber } from "../lib/utils";
 import {
   Select,
@@ -55,14 +55,15 @@ export function Dashboard() {
   const loadData = async () => {
     setLoading(true);
     try {
-      const [analyticsRes, dailyRes, monthsRes] = await Promise.all([
-        getAnalyticsSummary({ month: selectedMonth || undefined }),
-        getDailyAnalytics(),
-        getAvailableMonths(),
+      // One round trip for the whole dashboard
+      const { summary, daily, months: monthsRes } = await batchGet([
+        { id: "summary", path: "/analytics/summary", params: { month: selectedMonth || undefined } },
+        { id: "daily", path: "/analytics/daily" },
+        { id: "months", path: "/analytics/months" },
       ]);
-      setAnalytics(analyticsRes.data);
-      setDailyStats(dailyRes.data);
-      setMonths(monthsRes.data);
+      if (summary.status === 200) setAnalytics(summary.data);
+      if (daily.status === 200) setDailyStats(daily.data);
+      if (monthsRes.status === 200) setMonths(monthsRes.data);
     } catch (error) {
       console.error("Error loading data:", error);
     } finally {
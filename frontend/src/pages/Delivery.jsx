@@ -1,4 +1,4 @@
-import { useState, useEffect, useCallback } from "react";
+import { useState, useEffect, useCallback, useRef } from "react";
 import { Card, CardContent, CardHeader, CardTitle } from "../components/ui/card";
 import { Button } from "../components/ui/button";
 import { Input } from "../components/ui/input";
@@ -45,6 +45,7 @@ import {
 } from "lucide-react";
 import axios from "axios";
 import { formatCurrency, formatDate } from "../lib/utils";
+import { createTtn as createTtnRequest, newIdempotencyKey, waitForNpJob } from "../lib/api";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -104,6 +105,7 @@ export function Delivery() {
   const [ttnDialogOpen, setTtnDialogOpen] = useState(false);
   const [creatingTtn, setCreatingTtn] = useState(false);
   const [createdTtn, setCreatedTtn] = useState(null);
+  const ttnKeyRef = useRef(null);
 
   useEffect(() => {
     loadData();
@@ -226,9 +228,20 @@ export function Delivery() {
     
     setCreatingTtn(true);
     try {
-      const res = await axios.post(`${API}/nova-poshta/ttn`, ttnForm);
-      setCreatedTtn(res.data);
-      await loadData();
+      // Reuse the key if this submission is retried so no duplicate waybill is paid for
+      ttnKeyRef.current = ttnKeyRef.current || newIdempotencyKey();
+      const res = await createTtnRequest(ttnForm, ttnKeyRef.current);
+      ttnKeyRef.current = null;
+      const job = await waitForNpJob(res.data.id);
+      if (job.status === "succeeded") {
+        setCreatedTtn(job.result);
+        await loadData();
+      } else if (job.status === "failed") {
+        alert("Помилка створення ТТН: " + job.last_error);
+      } else {
+        alert("ТТН ще створюється" + (job.last_error ? ` (Нова Пошта: ${job.last_error})` : "") +
+          ". Вона з'явиться у списку, щойно Нова Пошта відповість.");
+      }
     } catch (error) {
       alert("Помилка створення ТТН: " + (error.response?.data?.detail || error.message));
     } finally {
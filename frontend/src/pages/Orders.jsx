@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { Card, CardContent, CardHeader, CardTitle } from "../components/ui/card";
 import { Button } from "../components/ui/button";
 import { Input } from "../components/ui/input";
@@ -40,6 +40,7 @@ import {
 import {
   getOrders,
   createOrder,
+  newIdempotencyKey,
   updateOrder,
   deleteOrder,
   getPrices,
@@ -101,6 +102,7 @@ export function Orders() {
   });
   const [showFilters, setShowFilters] = useState(false);
   const [calendarOpen, setCalendarOpen] = useState(false);
+  const submitKeyRef = useRef(null);
 
   useEffect(() => {
     loadData();
@@ -213,8 +215,11 @@ export function Orders() {
       if (editingOrder) {
         await updateOrder(editingOrder.id, orderForm);
       } else {
-        await createOrder(orderForm);
+        // Reuse the key if this submission is retried so no duplicate is created
+        submitKeyRef.current = submitKeyRef.current || newIdempotencyKey();
+        await createOrder(orderForm, submitKeyRef.current);
       }
+      submitKeyRef.current = null;
       setDialogOpen(false);
       setEditingOrder(null);
       setOrderForm(initialOrderForm);